@@ -1,13 +1,12 @@
 import os
-import requests
 import json
 import glob
 import shutil
-import time
 import re
 from datetime import datetime
 from typing import List, Dict, Optional
 import difflib
+from ai_backend import OpenRouterBackend, TokenBudget
 
 class AIAssistant:
     def __init__(self):
@@ -15,6 +14,8 @@ class AIAssistant:
         self.conversation_history = []
         self.config = self.load_config()
         self.session_actions = []  # Track all actions taken
+        self.backend = OpenRouterBackend(self.API_KEY)
+        self.token_budget = TokenBudget()
     
     def load_config(self):
         """Load configuration from file or defaults"""
@@ -198,44 +199,8 @@ class AIAssistant:
     
     def robust_ai_call(self, messages: List[Dict], model: str, max_retries: int = 3) -> Optional[Dict]:
         """AI call with retry logic and better error handling"""
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.API_KEY}",
-                        "HTTP-Referer": "http://localhost:3000",
-                        "X-Title": "Enhanced Code Assistant",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": model,
-                        "messages": messages,
-                        "temperature": 0.7
-                    },
-                    timeout=300
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 429:  # Rate limited
-                    print(f"⏳ Rate limited. Waiting... (attempt {attempt + 1})")
-                    time.sleep(2 ** attempt)
-                    continue
-                else:
-                    print(f"❌ API Error: {response.status_code} - {response.text}")
-                    return None
-                    
-            except requests.exceptions.Timeout:
-                print(f"⏰ Timeout on attempt {attempt + 1}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-            except Exception as e:
-                print(f"❌ Request Error: {e}")
-                return None
-        
-        return None
+        # Every request goes through here, so this is the one place to trim it to the model's window
+        return self.backend.chat(self.token_budget.fit(messages, model), model, max_retries)
     
     def read_project_files_smart(self) -> str:
         """Read essential project files"""
@@ -2020,7 +1985,7 @@ class AIAssistant:
             {"role": "user", "content": f"""
             Create a {sprint_duration}-day sprint plan for a team of {team_size} developers.
             
-            Project context: {context[:5000]}...
+            Project context: {context}
             
             Priority areas: {priority_areas}
             
@@ -0,0 +1,1179 @@
+#!/usr/bin/env python3
+"""
+🔌 Shared LLM Backend Layer
+One chat interface with OpenRouter, Ollama-chat and Ollama-generate drivers
+sharing connection pooling, streaming, retries, rate limiting and metrics
+"""
+
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import socket
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from threading import Lock, Event
+from typing import List, Dict, Optional, Iterator, Tuple
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+# Optional HTTP/2 support (pip install "httpx[http2]")
+try:
+    import httpx
+    import h2  # noqa: F401 - only needed so httpx can negotiate HTTP/2
+except ImportError:
+    httpx = None
+
+# Optional exact token counts (pip install tiktoken); a BPE-like heuristic is used otherwise
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Environment overrides let every entry point talk to a local stub (see stub_llm_server.py)
+OPENROUTER_URL = os.environ.get("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+OLLAMA_URL = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+if "://" not in OLLAMA_URL:  # the ollama client also accepts bare host:port
+    OLLAMA_URL = f"http://{OLLAMA_URL}"
+CASSETTE_PATH = ".ai_cassettes/session.jsonl.gz"
+
+# ==================== SHARED INFRASTRUCTURE ====================
+
+class BackendError(Exception):
+    """Error reported by a provider inside an otherwise successful response"""
+
+class Deadline:
+    """Total time budget for one operation, shared by every nested call, retry and scan"""
+    
+    def __init__(self, seconds: Optional[float] = None):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self.cancelled = Event()
+    
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None when the operation is unbounded"""
+        if self.cancelled.is_set():
+            return 0.0
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+    
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+    
+    def cancel(self):
+        """Stop all cooperating work as if the budget had run out"""
+        self.cancelled.set()
+    
+    def allows(self, seconds: float) -> bool:
+        """Whether waiting this long still leaves time to do something"""
+        remaining = self.remaining()
+        return remaining is None or seconds < remaining
+    
+    def timeout(self, default: float) -> float:
+        """Per-request timeout clamped to the time left"""
+        remaining = self.remaining()
+        return default if remaining is None else max(0.1, min(default, remaining))
+    
+    def sleep(self, seconds: float) -> bool:
+        """Sleep unless cancelled or out of time first; returns False when the budget is gone"""
+        if not self.allows(seconds):
+            return False
+        return not self.cancelled.wait(seconds)
+    
+    @contextmanager
+    def paused(self):
+        """Stop the clock while waiting on the user; only the work itself is budgeted"""
+        started = time.monotonic()
+        try:
+            yield self
+        finally:
+            if self.expires_at is not None:
+                self.expires_at += time.monotonic() - started
+
+class HTTPTransport:
+    """Shared keep-alive connection pool for LLM HTTP requests"""
+    
+    def __init__(self, pool_size=10, http2=True, headers: Optional[Dict] = None):
+        self.pool_size = pool_size
+        self.http2 = bool(http2 and httpx is not None)
+        self.headers = headers or {}
+        self.lock = Lock()
+        self.client = None
+        self.exclusive_session = None  # HTTP/1.1 session for abortable streams when the pool is HTTP/2
+        self.request_count = 0
+    
+    def get_client(self):
+        """Lazily create the pooled client (HTTP/2 when available)"""
+        with self.lock:
+            if self.client is None:
+                if self.http2:
+                    self.client = httpx.Client(
+                        http2=True,
+                        headers=self.headers,
+                        limits=httpx.Limits(
+                            max_connections=self.pool_size,
+                            max_keepalive_connections=self.pool_size
+                        )
+                    )
+                else:
+                    session = requests.Session()
+                    session.headers.update(self.headers)
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self.client = session
+            return self.client
+    
+    @property
+    def timeout_errors(self) -> tuple:
+        """Exception types raised by the active client on timeout"""
+        if self.http2:
+            return (httpx.TimeoutException, requests.exceptions.Timeout)
+        return (requests.exceptions.Timeout,)
+    
+    def get_exclusive_session(self):
+        """HTTP/1.1 session whose connections carry one response each, so aborting one is safe"""
+        with self.lock:
+            if self.exclusive_session is None:
+                self.exclusive_session = requests.Session()
+                self.exclusive_session.headers.update(self.headers)
+            return self.exclusive_session
+    
+    def post(self, url: str, payload: Dict, timeout: float = 300, headers: Optional[Dict] = None,
+             stream: bool = False, exclusive: bool = False):
+        """POST JSON over a pooled connection and return the response (exclusive: abortable via abort())"""
+        client = self.get_exclusive_session() if exclusive and self.http2 else self.get_client()
+        with self.lock:
+            self.request_count += 1
+        if stream and not isinstance(client, requests.Session):
+            request = client.build_request("POST", url, headers=headers, json=payload, timeout=timeout)
+            return client.send(request, stream=True)
+        if stream:
+            return client.post(url, headers=headers, json=payload, timeout=timeout, stream=True)
+        return client.post(url, headers=headers, json=payload, timeout=timeout)
+    
+    def iter_lines(self, response) -> Iterator[str]:
+        """Iterate decoded lines of a streamed response"""
+        if not isinstance(response, requests.Response):
+            return response.iter_lines()
+        response.encoding = response.encoding or "utf-8"
+        return response.iter_lines(decode_unicode=True)
+    
+    def abort(self, response):
+        """Close a response from another thread, waking a reader blocked waiting for data"""
+        # close() alone leaves a blocked recv() waiting until the read timeout; shutdown wakes it.
+        # Only requests (HTTP/1.1) responses own their socket; an HTTP/2 socket is shared by other streams.
+        if isinstance(response, requests.Response):
+            sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        try:
+            response.close()
+        except Exception:
+            pass
+    
+    def close(self):
+        """Close all pooled connections"""
+        with self.lock:
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+            if self.exclusive_session is not None:
+                self.exclusive_session.close()
+                self.exclusive_session = None
+
+class RecordedResponse:
+    """Response replayed from a cassette, shaped like a requests/httpx response"""
+    
+    def __init__(self, entry: Dict, speed: float = 0.0):
+        self.status_code = entry["status"]
+        self.headers = entry.get("headers", {})
+        self.text = entry.get("body", "")
+        self.lines = entry.get("lines", [])  # [seconds since request, line]
+        self.speed = speed
+    
+    def json(self):
+        return json.loads(self.text)
+    
+    def iter_lines(self) -> Iterator[str]:
+        """Yield recorded stream lines, paced by their recorded offsets divided by speed"""
+        started = time.monotonic()
+        for offset, line in self.lines:
+            if self.speed > 0:
+                delay = offset / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield line
+    
+    def close(self):
+        pass
+
+class CassetteTransport:
+    """Wrap a transport to record LLM traffic to a gzipped JSONL cassette, or replay it offline"""
+    
+    RECORDED_HEADERS = ("Content-Type", "Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining",
+                        "X-RateLimit-Reset")
+    
+    def __init__(self, inner: HTTPTransport, mode: str, path: str, speed: float = 0.0):
+        self.inner = inner
+        self.mode = mode  # "record" or "replay"
+        self.path = path
+        self.speed = speed  # replay pacing: 1.0 = recorded speed, 10 = ten times faster, 0 = instant
+        self.lock = Lock()
+        self.entries = {}  # request key -> recorded entries, served in order
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        if mode == "replay":
+            self.load()
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    @staticmethod
+    def request_key(url: str, payload: Dict) -> str:
+        """Stable key for a request: endpoint path plus canonical JSON payload (host-independent)"""
+        body = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{urlparse(url).path}\n{body}".encode("utf-8")).hexdigest()
+    
+    def load(self):
+        """Index every recorded exchange by request key"""
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries.setdefault(entry["key"], []).append(entry)
+        except FileNotFoundError:
+            print(f"⚠️  Cassette not found: {self.path}")
+        count = sum(len(entries) for entries in self.entries.values())
+        print(f"📼 Replaying {count} recorded LLM exchanges from {self.path}")
+    
+    def write(self, entry: Dict):
+        """Append one exchange (gzip members can be concatenated)"""
+        with self.lock:
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.stats["recorded"] += 1
+    
+    @property
+    def timeout_errors(self) -> tuple:
+        return self.inner.timeout_errors
+    
+    @property
+    def request_count(self) -> int:
+        return self.inner.request_count
+    
+    def post(self, url: str, payload: Dict, timeout: float = 300, headers: Optional[Dict] = None,
+             stream: bool = False, exclusive: bool = False):
+        key = self.request_key(url, payload)
+        if self.mode == "replay":
+            return self.replay(key, url)
+        
+        start = time.monotonic()
+        response = self.inner.post(url, payload, timeout=timeout, headers=headers, stream=stream,
+                                   exclusive=exclusive)
+        entry = {
+            "key": key,
+            "url": url,
+            "model": payload.get("model"),
+            "recorded_at": datetime.now().isoformat(),
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in self.RECORDED_HEADERS if name in response.headers},
+            "elapsed": round(time.monotonic() - start, 4)
+        }
+        if stream and response.status_code == 200:
+            # Written once the caller has consumed (or abandoned) the stream
+            response.cassette_entry = entry
+            response.cassette_start = start
+            return response
+        entry["body"] = response.text
+        self.write(entry)
+        return response
+    
+    def replay(self, key: str, url: str) -> RecordedResponse:
+        with self.lock:
+            queue = self.entries.get(key)
+            if not queue:
+                self.stats["misses"] += 1
+                raise BackendError(f"No recorded response in cassette for this request ({url})")
+            # Identical requests are served in recorded order; the last one repeats
+            entry = queue.pop(0) if len(queue) > 1 else queue[0]
+            self.stats["replayed"] += 1
+        if self.speed > 0 and not entry.get("lines"):
+            time.sleep(entry.get("elapsed", 0) / self.speed)
+        return RecordedResponse(entry, self.speed)
+    
+    def iter_lines(self, response) -> Iterator[str]:
+        if isinstance(response, RecordedResponse):
+            return response.iter_lines()
+        entry = getattr(response, "cassette_entry", None)
+        if entry is None:
+            return self.inner.iter_lines(response)
+        return self.record_lines(response, entry)
+    
+    def record_lines(self, response, entry: Dict) -> Iterator[str]:
+        """Pass stream lines through while noting when each arrived"""
+        lines = []
+        try:
+            for line in self.inner.iter_lines(response):
+                lines.append([round(time.monotonic() - response.cassette_start, 4), line])
+                yield line
+        finally:
+            entry["lines"] = lines
+            entry["elapsed"] = round(time.monotonic() - response.cassette_start, 4)
+            self.write(entry)
+    
+    def abort(self, response):
+        if isinstance(response, RecordedResponse):
+            response.close()
+        else:
+            self.inner.abort(response)
+    
+    def close(self):
+        self.inner.close()
+
+class StreamHandle:
+    """Lets another thread abort a streaming call, even while it is still waiting for the first token"""
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.transport = None
+        self.response = None
+        self.cancelled = False
+    
+    def attach(self, transport, response) -> bool:
+        """Register the live response; False (and the response aborted) if already cancelled"""
+        with self.lock:
+            if not self.cancelled:
+                self.transport, self.response = transport, response
+                return True
+        transport.abort(response)
+        return False
+    
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            transport, response = self.transport, self.response
+        if response is not None:
+            transport.abort(response)
+
+class RateLimiter:
+    """Process-wide adaptive token-bucket limiter shared by all AI calls"""
+    
+    _shared = None
+    _shared_lock = Lock()
+    
+    def __init__(self, requests_per_minute=60, burst=5, per_model_limits: Optional[Dict] = None):
+        self.max_rate = requests_per_minute / 60.0
+        self.burst = burst
+        self.per_model_limits = per_model_limits or {}
+        self.lock = Lock()
+        self.buckets = {}
+        self.stats = {"requests": 0, "rate_limited": 0, "seconds_waited": 0.0}
+    
+    @classmethod
+    def shared(cls, requests_per_minute=60, burst=5, per_model_limits: Optional[Dict] = None) -> "RateLimiter":
+        """Return the single limiter instance used by every assistant/thread in this process"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(requests_per_minute, burst, per_model_limits)
+            return cls._shared
+    
+    def get_bucket(self, key: str) -> Dict:
+        """Bucket for a model, or '*' for the whole API key (caller holds the lock)"""
+        if key not in self.buckets:
+            max_rate = self.per_model_limits.get(key, self.max_rate * 60) / 60.0
+            self.buckets[key] = {
+                "tokens": float(self.burst),
+                "rate": max_rate,
+                "max_rate": max_rate,
+                "updated": time.monotonic(),
+                "blocked_until": 0.0
+            }
+        return self.buckets[key]
+    
+    def reserve(self, model: str) -> float:
+        """Take a token from the global and model buckets, return seconds to wait first"""
+        now = time.monotonic()
+        delay = 0.0
+        with self.lock:
+            for key in ("*", model):
+                bucket = self.get_bucket(key)
+                elapsed = now - bucket["updated"]
+                bucket["tokens"] = min(self.burst, bucket["tokens"] + elapsed * bucket["rate"])
+                bucket["updated"] = now
+                # Tokens may go negative: later callers queue up behind earlier ones
+                bucket["tokens"] -= 1
+                if bucket["tokens"] < 0:
+                    delay = max(delay, -bucket["tokens"] / bucket["rate"])
+                delay = max(delay, bucket["blocked_until"] - now)
+            self.stats["requests"] += 1
+            self.stats["seconds_waited"] += delay
+        return delay
+    
+    def wait(self, model: str):
+        """Blocking pacing for synchronous callers"""
+        delay = self.reserve(model)
+        if delay > 0:
+            time.sleep(delay)
+    
+    @staticmethod
+    def parse_reset(value: str) -> Optional[float]:
+        """Seconds until a Retry-After / X-RateLimit-Reset value expires"""
+        if not value:
+            return None
+        try:
+            number = float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+        if number > 1e12:  # epoch milliseconds (OpenRouter)
+            return max(0.0, number / 1000 - time.time())
+        if number > 1e9:  # epoch seconds
+            return max(0.0, number - time.time())
+        return max(0.0, number)
+    
+    def block(self, key: str, seconds: float):
+        """Hold back all requests on a bucket for the given time (caller holds the lock)"""
+        bucket = self.get_bucket(key)
+        bucket["blocked_until"] = max(bucket["blocked_until"], time.monotonic() + seconds)
+    
+    def on_success(self, model: str, headers):
+        """Recover rate additively and respect the remaining quota the provider reports"""
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_in = self.parse_reset(headers.get("X-RateLimit-Reset"))
+        with self.lock:
+            for key in ("*", model):
+                bucket = self.get_bucket(key)
+                bucket["rate"] = min(bucket["max_rate"], bucket["rate"] + bucket["max_rate"] * 0.1)
+            if remaining is not None and reset_in is not None:
+                try:
+                    remaining = int(remaining)
+                except ValueError:
+                    return
+                if remaining <= 0:
+                    self.block("*", reset_in)
+                else:
+                    # Never hold more burst than the provider still allows
+                    bucket = self.get_bucket("*")
+                    bucket["tokens"] = min(bucket["tokens"], float(remaining))
+    
+    def on_rate_limited(self, model: str, headers, attempt: int) -> float:
+        """Halve the model's rate after a 429 and return how long to back off"""
+        retry_after = self.parse_reset(headers.get("Retry-After"))
+        if retry_after is None:
+            retry_after = self.parse_reset(headers.get("X-RateLimit-Reset"))
+        if retry_after is None:
+            retry_after = float(2 ** attempt)
+        with self.lock:
+            bucket = self.get_bucket(model)
+            bucket["rate"] = max(bucket["max_rate"] / 16, bucket["rate"] / 2)
+            self.block(model, retry_after)
+            self.stats["rate_limited"] += 1
+        return retry_after
+
+class CallMetrics:
+    """Thread-safe latency and throughput log for every call through a backend"""
+    
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.calls = []
+        self.deadline_stops = {}  # model -> attempts cut short by a caller's deadline, not the model's fault
+        self.lock = Lock()
+    
+    def record(self, model: str, start: float, first_token_at: Optional[float], output_tokens: int,
+               streamed: bool = False, metrics: Optional[Dict] = None, provider: Optional[Dict] = None,
+               input_tokens: int = 0, cached_tokens: Optional[int] = None) -> Dict:
+        """Record latency, time-to-first-token and tokens/sec for one call"""
+        end = time.perf_counter()
+        latency = end - start
+        # Without streaming the first token only arrives with the full response
+        ttft = (first_token_at - start) if first_token_at is not None else latency
+        generation_time = end - first_token_at if first_token_at is not None else latency
+        entry = metrics if metrics is not None else {}
+        entry.update({
+            "model": model,
+            "streamed": streamed,
+            "latency": round(latency, 3),
+            "ttft": round(ttft, 3),
+            "input_tokens": input_tokens,
+            "cached_tokens": cached_tokens,  # None when the provider doesn't report prefix-cache hits
+            "output_tokens": output_tokens,
+            "tokens_per_sec": round(output_tokens / generation_time, 1) if generation_time > 0 else 0.0,
+            "timestamp": datetime.now().isoformat()
+        })
+        if provider:
+            entry["provider"] = provider
+        with self.lock:
+            self.calls.append(dict(entry))
+            if len(self.calls) > self.max_entries:
+                self.calls = self.calls[-self.max_entries:]
+        return entry
+    
+    def record_failure(self, model: str, reason: str):
+        """Record a failed attempt (timeout, rate limit, API or transport error)"""
+        with self.lock:
+            self.calls.append({
+                "model": model,
+                "failed": True,
+                "reason": reason,
+                "timestamp": datetime.now().isoformat()
+            })
+            if len(self.calls) > self.max_entries:
+                self.calls = self.calls[-self.max_entries:]
+    
+    def record_deadline_stop(self, model: str):
+        """Count an attempt the caller's deadline cut short; kept out of error rates and latencies"""
+        with self.lock:
+            self.deadline_stops[model] = self.deadline_stops.get(model, 0) + 1
+    
+    def latencies(self, model: str, last: int = 200) -> List[float]:
+        """Recent successful call latencies for a model"""
+        with self.lock:
+            return [m["latency"] for m in self.calls[-last:] if m["model"] == model and not m.get("failed")]
+    
+    def prefix_cache_stats(self, last: int = 200) -> Dict:
+        """Share of prompt tokens served from the provider's prefix cache, over calls that report it"""
+        with self.lock:
+            reported = [m for m in self.calls[-last:] if m.get("cached_tokens") is not None]
+        input_tokens = sum(m["input_tokens"] for m in reported)
+        cached_tokens = sum(m["cached_tokens"] for m in reported)
+        return {
+            "calls": len(reported),
+            "calls_with_hits": sum(1 for m in reported if m["cached_tokens"] > 0),
+            "input_tokens": input_tokens,
+            "cached_tokens": cached_tokens,
+            "hit_rate": cached_tokens / input_tokens if input_tokens else 0.0
+        }
+    
+    def error_rate(self, model: str, last: int = 50) -> float:
+        """Share of a model's recent attempts that failed"""
+        with self.lock:
+            recent = [m for m in self.calls if m["model"] == model][-last:]
+        if not recent:
+            return 0.0
+        return sum(1 for m in recent if m.get("failed")) / len(recent)
+
+class TokenBudget:
+    """Estimate prompt tokens per message and trim or pack context to fit a model's window"""
+    
+    DEFAULT_WINDOWS = {
+        "mistralai/mistral-7b-instruct:nitro": 32768,
+        "meta-llama/llama-3-70b-instruct:nitro": 8192,
+        "anthropic/claude-3-haiku:nitro": 200000,
+        "deepseek-coder:6.7b": 16384,
+        "codellama:7b": 16384
+    }
+    MESSAGE_OVERHEAD = 4  # role and separator tokens per chat message
+    SECTION_HEADER = re.compile(r"(?=\n=== .+? ===\n)")  # context blocks built by the file readers
+    _encoding = None
+    
+    def __init__(self, context_windows: Optional[Dict] = None, reserve_output: int = 1024,
+                 default_window: int = 8192):
+        self.windows = dict(self.DEFAULT_WINDOWS)
+        self.windows.update(context_windows or {})
+        self.reserve_output = reserve_output
+        self.default_window = default_window
+    
+    @classmethod
+    def count(cls, text: str) -> int:
+        """Tokens in a piece of text (exact with tiktoken, otherwise estimated)"""
+        if not text:
+            return 0
+        if tiktoken is not None:
+            if cls._encoding is None:
+                cls._encoding = tiktoken.get_encoding("cl100k_base")
+            return len(cls._encoding.encode(text, disallowed_special=()))
+        # Roughly one token per 4 characters of a word, plus one per symbol (code is symbol-heavy)
+        words = re.findall(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]", text)
+        return sum(math.ceil(len(w) / 4) for w in words)
+    
+    @classmethod
+    def count_messages(cls, messages: List[Dict]) -> int:
+        """Prompt tokens for a chat request"""
+        return sum(cls.count(msg.get("content", "")) + cls.MESSAGE_OVERHEAD for msg in messages) + 2
+    
+    def window(self, model: str) -> int:
+        return self.windows.get(model, self.default_window)
+    
+    def available(self, model: str) -> int:
+        """Prompt tokens the model accepts while leaving room for the answer"""
+        return max(0, self.window(model) - self.reserve_output)
+    
+    def fits(self, messages: List[Dict], model: str) -> bool:
+        return self.count_messages(messages) <= self.available(model)
+    
+    def trim_text(self, text: str, max_tokens: int) -> str:
+        """Cut the middle out of text so it fits max_tokens, keeping its head and tail"""
+        total = self.count(text)
+        if total <= max_tokens:
+            return text
+        marker = "\n... [{} tokens trimmed to fit the context window] ...\n"
+        keep_chars = int(len(text) * max(0, max_tokens - 20) / total)
+        # Shrink until the estimate fits (usually one or two passes)
+        while True:
+            head = text[:keep_chars * 2 // 3]
+            tail = text[len(text) - keep_chars // 3:] if keep_chars >= 3 else ""
+            trimmed = head + marker.format(total - self.count(head) - self.count(tail)) + tail
+            if self.count(trimmed) <= max_tokens or keep_chars == 0:
+                return trimmed
+            keep_chars = int(keep_chars * 0.9)
+    
+    def pack_sections(self, text: str, max_tokens: int) -> str:
+        """Keep whole '=== file ===' sections in order while they fit, trimming the first that doesn't"""
+        # The question usually follows the context after a blank line; it must survive packing
+        body, _, tail = text.rpartition("\n\n")
+        suffix = "\n\n" + tail if body and self.count(tail) < max_tokens // 4 else ""
+        if suffix:
+            text = body
+            max_tokens -= self.count(suffix)
+        sections = self.SECTION_HEADER.split(text)
+        if len(sections) < 2:
+            return self.trim_text(text, max_tokens) + suffix
+        packed = []
+        used = 0
+        dropped = 0
+        for section in sections:
+            size = self.count(section)
+            if dropped == 0 and used + size <= max_tokens:
+                packed.append(section)
+                used += size
+            elif dropped == 0 and max_tokens - used > 200:
+                packed.append(self.trim_text(section, max_tokens - used - 20))
+                used = max_tokens
+                dropped += 1
+            else:
+                dropped += 1
+        if dropped:
+            packed.append(f"\n... [{dropped} context section(s) omitted to fit the context window]\n")
+        return "".join(packed) + suffix
+    
+    def fit(self, messages: List[Dict], model: str) -> List[Dict]:
+        """Shrink the largest message until the request fits the model, packing file sections first"""
+        total = self.count_messages(messages)
+        limit = self.available(model)
+        if total <= limit:
+            return messages
+        largest = max(range(len(messages)), key=lambda i: len(messages[i].get("content", "")))
+        content = messages[largest]["content"]
+        budget = self.count(content) - (total - limit)
+        if budget <= 0:
+            print(f"⚠️  Prompt of {total} tokens cannot be trimmed to fit {model} ({self.window(model)} tokens)")
+            return messages
+        fitted = list(messages)
+        fitted[largest] = {key: value for key, value in messages[largest].items() if key != "prefix_len"}
+        fitted[largest]["content"] = self.pack_sections(content, budget)
+        print(f"✂️  Prompt trimmed from {total} to {self.count_messages(fitted)} tokens "
+              f"to fit {model} ({self.window(model)} token window)")
+        return fitted
+
+class ModelRouter:
+    """Pick the cheapest model that fits the prompt and meets the latency SLO"""
+    
+    def __init__(self, models: List[Dict], metrics: CallMetrics, latency_slo: float = 30.0,
+                 max_error_rate: float = 0.3, task_min_tier: Optional[Dict] = None):
+        # Each model: {"id": ..., "tier": 1 (small/fast) .. n (large), "context": max tokens}
+        self.models = sorted(models, key=lambda m: m["tier"])
+        self.metrics = metrics
+        self.latency_slo = latency_slo
+        self.max_error_rate = max_error_rate
+        self.task_min_tier = task_min_tier or {}
+    
+    @staticmethod
+    def estimate_tokens(messages: List[Dict]) -> int:
+        return TokenBudget.count_messages(messages)
+    
+    def p50_latency(self, model: str) -> Optional[float]:
+        latencies = sorted(self.metrics.latencies(model, last=50))
+        return latencies[len(latencies) // 2] if latencies else None
+    
+    def eligible(self, task_type: str, prompt_tokens: int) -> List[Dict]:
+        """Models allowed for the task whose context window fits the prompt plus an answer"""
+        min_tier = self.task_min_tier.get(task_type, 1)
+        return [
+            m for m in self.models
+            if m["tier"] >= min_tier and prompt_tokens + 1024 <= m.get("context", 8192)
+        ]
+    
+    def route(self, task_type: str, prompt_tokens: int) -> str:
+        """Smallest healthy model within the SLO, else the fastest eligible one"""
+        candidates = self.eligible(task_type, prompt_tokens)
+        if not candidates:
+            # Nothing fits: the largest context window gives the best chance
+            return max(self.models, key=lambda m: m.get("context", 0))["id"]
+        
+        for m in candidates:
+            p50 = self.p50_latency(m["id"])
+            if self.metrics.error_rate(m["id"]) > self.max_error_rate:
+                continue
+            if p50 is not None and p50 > self.latency_slo:
+                continue
+            return m["id"]
+        
+        # Everything is slow or flaky: the fastest healthy model, else the least flaky one
+        healthy = [m for m in candidates if self.metrics.error_rate(m["id"]) <= self.max_error_rate]
+        if not healthy:
+            return min(candidates, key=lambda m: self.metrics.error_rate(m["id"]))["id"]
+        # No successful calls means no evidence of speed, not a latency of zero
+        return min(healthy, key=lambda m: self.p50_latency(m["id"]) or float("inf"))["id"]
+    
+    def escalate(self, model: str, task_type: str, prompt_tokens: int) -> Optional[str]:
+        """Next larger eligible model after a failed validation, if any"""
+        current = next((m for m in self.models if m["id"] == model), None)
+        current_tier = current["tier"] if current else 0
+        for m in self.eligible(task_type, prompt_tokens):
+            if m["tier"] > current_tier and self.metrics.error_rate(m["id"]) <= self.max_error_rate:
+                return m["id"]
+        return None
+
+# ==================== BACKEND INTERFACE ====================
+
+class LLMBackend:
+    """Provider-agnostic chat backend; drivers only describe payloads and responses"""
+    
+    name = "base"
+    retry_connection_errors = False  # Local servers may still be starting up
+    DEFAULT_OPTIONS = {}  # Sampling options the driver sends when the caller gives none
+    
+    def __init__(self, transport: HTTPTransport, rate_limiter: Optional[RateLimiter] = None,
+                 metrics: Optional[CallMetrics] = None, timeout: float = 300):
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics or CallMetrics()
+        self.timeout = timeout
+        # LLM_CASSETTE_MODE=record|replay turns on cassettes for every entry point
+        if os.environ.get("LLM_CASSETTE_MODE"):
+            self.use_cassette(
+                os.environ["LLM_CASSETTE_MODE"],
+                os.environ.get("LLM_CASSETTE", CASSETTE_PATH),
+                float(os.environ.get("LLM_REPLAY_SPEED", 0))
+            )
+    
+    def use_cassette(self, mode: str, path: str = None, speed: float = 0.0):
+        """Record all traffic to a cassette, or serve it from one without network access"""
+        if mode not in ("record", "replay"):
+            print(f"⚠️  Unknown cassette mode: {mode}")
+            return
+        path = path or CASSETTE_PATH
+        inner = self.transport.inner if isinstance(self.transport, CassetteTransport) else self.transport
+        self.transport = CassetteTransport(inner, mode, path, speed)
+        if mode == "replay":
+            # Recorded traffic already reflects the provider's limits
+            self.rate_limiter = None
+        else:
+            print(f"📼 Recording LLM traffic to {path}")
+    
+    # ---------- driver hooks ----------
+    
+    def endpoint(self, stream: bool) -> str:
+        raise NotImplementedError
+    
+    def build_payload(self, messages: List[Dict], model: str, stream: bool, options: Dict) -> Dict:
+        raise NotImplementedError
+    
+    def parse_response(self, data: Dict) -> Dict:
+        """Normalize a provider response to the OpenRouter/OpenAI shape"""
+        raise NotImplementedError
+    
+    def parse_stream_line(self, line: str) -> Tuple[Optional[str], Optional[Dict], bool]:
+        """Return (token, final info, done) for one line of the stream"""
+        raise NotImplementedError
+    
+    def cached_tokens(self, usage: Dict) -> Optional[int]:
+        """Prompt tokens served from the provider's prefix cache, if the provider reports them"""
+        return None
+    
+    # ---------- shared behaviour ----------
+    
+    def backoff(self, model: str, headers, attempt: int) -> float:
+        """Seconds to wait after a 429 (0 when the rate limiter already blocks the bucket)"""
+        if self.rate_limiter:
+            wait = self.rate_limiter.on_rate_limited(model, headers, attempt)
+            print(f"⏳ Rate limited. Waiting {wait:.1f}s... (attempt {attempt + 1}, {model})")
+            return 0.0
+        print(f"⏳ Rate limited. Waiting... (attempt {attempt + 1}, {model})")
+        return float(2 ** attempt)
+    
+    def pace(self, model: str, deadline: Optional[Deadline] = None) -> bool:
+        """Wait for a rate-limit slot; False when that would overrun the deadline"""
+        if deadline is not None and deadline.expired:
+            print(f"⌛ Deadline reached, skipping request ({model})")
+            return False
+        if not self.rate_limiter:
+            return True
+        delay = self.rate_limiter.reserve(model)
+        if delay <= 0:
+            return True
+        if deadline is not None:
+            if not deadline.sleep(delay):
+                print(f"⌛ Deadline reached while waiting for a rate-limit slot ({model})")
+                return False
+            return True
+        time.sleep(delay)
+        return True
+    
+    def request_timeout(self, deadline: Optional[Deadline] = None) -> float:
+        return deadline.timeout(self.timeout) if deadline is not None else self.timeout
+    
+    def record_timeout(self, model: str, attempt: int, timeout: float, deadline: Optional[Deadline] = None):
+        """A timeout only counts against the model when the deadline did not shorten it"""
+        if deadline is not None and (deadline.expired or timeout < self.timeout):
+            print(f"⌛ Deadline cut attempt {attempt + 1} short ({model})")
+            self.metrics.record_deadline_stop(model)
+            return
+        print(f"⏰ Timeout on attempt {attempt + 1} ({model})")
+        self.metrics.record_failure(model, "timeout")
+    
+    def attempt(self, messages: List[Dict], model: str, attempt: int = 0, metrics: Optional[Dict] = None,
+                pace: bool = True, deadline: Optional[Deadline] = None, **options) -> Tuple[str, object]:
+        """One non-streaming request: ("ok", response), ("retry", seconds) or ("fail", None)"""
+        if pace and not self.pace(model, deadline):
+            return "fail", None
+        if deadline is not None and deadline.expired:
+            return "fail", None
+        start = time.perf_counter()
+        timeout = self.request_timeout(deadline)
+        try:
+            response = self.transport.post(
+                self.endpoint(False), self.build_payload(messages, model, False, options),
+                timeout=timeout
+            )
+        except self.transport.timeout_errors:
+            self.record_timeout(model, attempt, timeout, deadline)
+            return "retry", float(2 ** attempt)
+        except Exception as e:
+            self.metrics.record_failure(model, "error")
+            if self.retry_connection_errors:
+                print(f"❌ {self.name} error (attempt {attempt + 1}): {e}")
+                return "retry", float(2 ** attempt)
+            print(f"❌ Request Error: {e}")
+            return "fail", None
+        
+        if response.status_code == 200:
+            if self.rate_limiter:
+                self.rate_limiter.on_success(model, response.headers)
+            try:
+                result = self.parse_response(response.json())
+            except (ValueError, BackendError) as e:
+                # Malformed body or an error object inside a 200 reply
+                print(f"❌ Invalid response from {self.name}: {e}")
+                self.metrics.record_failure(model, "bad_response")
+                return "fail", None
+            usage = result.get("usage") or {}
+            self.metrics.record(model, start, None, usage.get("completion_tokens", 0),
+                                metrics=metrics, provider=result.get("timings"),
+                                input_tokens=usage.get("prompt_tokens") or TokenBudget.count_messages(messages),
+                                cached_tokens=self.cached_tokens(usage))
+            return "ok", result
+        elif response.status_code == 429:  # Rate limited
+            self.metrics.record_failure(model, "rate_limited")
+            return "retry", self.backoff(model, response.headers, attempt)
+        print(f"❌ API Error: {response.status_code} - {response.text}")
+        self.metrics.record_failure(model, f"http_{response.status_code}")
+        return "fail", None
+    
+    def retry_wait(self, seconds: float, deadline: Optional[Deadline] = None) -> bool:
+        """Back off before the next attempt; False when the deadline leaves no time for it"""
+        if deadline is not None:
+            if not deadline.sleep(seconds):
+                print("⌛ Deadline reached, giving up on retries")
+                return False
+            return True
+        time.sleep(seconds)
+        return True
+    
+    def chat(self, messages: List[Dict], model: str, max_retries: int = 3,
+             metrics: Optional[Dict] = None, deadline: Optional[Deadline] = None, **options) -> Optional[Dict]:
+        """Blocking chat call with retry/backoff"""
+        for attempt in range(max_retries):
+            status, value = self.attempt(messages, model, attempt, metrics=metrics, deadline=deadline, **options)
+            if status == "ok":
+                return value
+            if status == "fail":
+                return None
+            if value and attempt < max_retries - 1 and not self.retry_wait(value, deadline):
+                return None
+        return None
+    
+    def stream_chat(self, messages: List[Dict], model: str, max_retries: int = 3,
+                    metrics: Optional[Dict] = None, deadline: Optional[Deadline] = None,
+                    handle: Optional[StreamHandle] = None, **options) -> Iterator[str]:
+        """Yield response tokens as they arrive, retrying only before the stream starts"""
+        payload = self.build_payload(messages, model, True, options)
+        
+        for attempt in range(max_retries):
+            if handle is not None and handle.cancelled:
+                return
+            if not self.pace(model, deadline):
+                return
+            start = time.perf_counter()
+            timeout = self.request_timeout(deadline)
+            try:
+                response = self.transport.post(self.endpoint(True), payload, timeout=timeout, stream=True,
+                                               exclusive=handle is not None)
+            except self.transport.timeout_errors:
+                self.record_timeout(model, attempt, timeout, deadline)
+                if attempt < max_retries - 1 and not self.retry_wait(2 ** attempt, deadline):
+                    return
+                continue
+            except Exception as e:
+                self.metrics.record_failure(model, "error")
+                if self.retry_connection_errors and attempt < max_retries - 1:
+                    print(f"❌ {self.name} error (attempt {attempt + 1}): {e}")
+                    if not self.retry_wait(2 ** attempt, deadline):
+                        return
+                    continue
+                print(f"❌ Request Error: {e}")
+                return
+            if handle is not None and not handle.attach(self.transport, response):
+                return
+            
+            try:
+                if response.status_code == 429:  # Rate limited
+                    self.metrics.record_failure(model, "rate_limited")
+                    wait = self.backoff(model, response.headers, attempt)
+                    if wait and attempt < max_retries - 1 and not self.retry_wait(wait, deadline):
+                        return
+                    continue
+                elif response.status_code != 200:
+                    print(f"❌ API Error: {response.status_code}")
+                    self.metrics.record_failure(model, f"http_{response.status_code}")
+                    return
+                if self.rate_limiter:
+                    self.rate_limiter.on_success(model, response.headers)
+                
+                first_token_at = None
+                chunk_count = 0
+                final = {}
+                for line in self.transport.iter_lines(response):
+                    if deadline is not None and deadline.expired:
+                        # Partial output is not a result: skip metrics so callers discard it
+                        print(f"\n⌛ Deadline reached, stopping stream ({model})")
+                        return
+                    if not line:
+                        continue
+                    token, info, done = self.parse_stream_line(line)
+                    if info:
+                        final.update(info)
+                    if token:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        chunk_count += 1
+                        yield token
+                    if done:
+                        break
+                
+                usage = final.get("usage") or {}
+                self.metrics.record(model, start, first_token_at, usage.get("completion_tokens", chunk_count),
+                                    streamed=True, metrics=metrics, provider=final.get("timings"),
+                                    input_tokens=usage.get("prompt_tokens") or TokenBudget.count_messages(messages),
+                                    cached_tokens=self.cached_tokens(usage))
+                if metrics is not None and final.get("context"):
+                    # Ollama /api/generate state to continue the conversation without re-sending it
+                    metrics["context"] = final["context"]
+                return
+            finally:
+                response.close()
+    
+    def close(self):
+        """Close pooled connections"""
+        self.transport.close()
+
+# ==================== DRIVERS ====================
+
+class OpenRouterBackend(LLMBackend):
+    """OpenRouter chat-completions driver (SSE streaming)"""
+    
+    name = "OpenRouter"
+    MIN_CACHEABLE_TOKENS = 1024
+    DEFAULT_OPTIONS = {"temperature": 0.7}
+    
+    def __init__(self, api_key: str, pool_size=10, http2=True, rate_limiter: Optional[RateLimiter] = None,
+                 metrics: Optional[CallMetrics] = None, url: str = OPENROUTER_URL):
+        transport = HTTPTransport(
+            pool_size=pool_size,
+            http2=http2,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "HTTP-Referer": "http://localhost:3000",
+                "X-Title": "Enhanced Code Assistant",
+                "Content-Type": "application/json"
+            }
+        )
+        super().__init__(transport, rate_limiter, metrics, timeout=300)
+        self.url = url
+    
+    def endpoint(self, stream: bool) -> str:
+        return self.url
+    
+    def build_payload(self, messages: List[Dict], model: str, stream: bool, options: Dict) -> Dict:
+        payload = {
+            "model": model,
+            "messages": [self.format_message(msg, model) for msg in messages],
+            "temperature": options.get("temperature", self.DEFAULT_OPTIONS["temperature"]),
+            "usage": {"include": True}  # token accounting, including prefix-cache hits
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    def format_message(self, msg: Dict, model: str) -> Dict:
+        """Mark a long stable prefix as cacheable for providers that need explicit breakpoints"""
+        prefix_len = msg.get("prefix_len")
+        message = {"role": msg["role"], "content": msg["content"]}
+        # Anthropic only caches marked blocks of at least ~1024 tokens; others cache prefixes automatically
+        if (prefix_len and model.startswith("anthropic/")
+                and TokenBudget.count(msg["content"][:prefix_len]) >= self.MIN_CACHEABLE_TOKENS):
+            message["content"] = [
+                {"type": "text", "text": msg["content"][:prefix_len], "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": msg["content"][prefix_len:]}
+            ]
+        return message
+    
+    def cached_tokens(self, usage: Dict) -> Optional[int]:
+        details = usage.get("prompt_tokens_details")
+        if not isinstance(details, dict) or details.get("cached_tokens") is None:
+            return None
+        return details["cached_tokens"]
+    
+    def parse_response(self, data: Dict) -> Dict:
+        return data
+    
+    def parse_stream_line(self, line: str) -> Tuple[Optional[str], Optional[Dict], bool]:
+        # Skip keep-alive comments (": OPENROUTER PROCESSING")
+        if not line.startswith("data:"):
+            return None, None, False
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return None, None, True
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            return None, None, False
+        if chunk.get("error"):
+            raise BackendError(chunk["error"].get("message", chunk["error"]))
+        info = {"usage": chunk["usage"]} if chunk.get("usage") else None
+        choices = chunk.get("choices") or []
+        token = (choices[0].get("delta") or {}).get("content") if choices else None
+        return token, info, False
+
+class OllamaChatBackend(LLMBackend):
+    """Local Ollama /api/chat driver (NDJSON streaming)"""
+    
+    name = "Ollama"
+    retry_connection_errors = True
+    
+    def __init__(self, base_url: str = OLLAMA_URL, pool_size=4, metrics: Optional[CallMetrics] = None,
+                 timeout: float = 300):
+        super().__init__(HTTPTransport(pool_size=pool_size, http2=False), None, metrics, timeout)
+        self.base_url = base_url.rstrip("/")
+    
+    def endpoint(self, stream: bool) -> str:
+        return f"{self.base_url}/api/chat"
+    
+    def build_options(self, payload: Dict, options: Dict) -> Dict:
+        """Add Ollama sampling options, the context size and keep_alive"""
+        model_options = {}
+        if "temperature" in options:
+            model_options["temperature"] = options["temperature"]
+        # Ollama silently truncates prompts to its own small default unless told the real window
+        num_ctx = options.get("num_ctx") or TokenBudget.DEFAULT_WINDOWS.get(payload["model"])
+        if num_ctx:
+            model_options["num_ctx"] = num_ctx
+        if model_options:
+            payload["options"] = model_options
+        if options.get("keep_alive") is not None:
+            payload["keep_alive"] = options["keep_alive"]
+        return payload
+    
+    def build_payload(self, messages: List[Dict], model: str, stream: bool, options: Dict) -> Dict:
+        return self.build_options({
+            "model": model,
+            "messages": [{"role": msg["role"], "content": msg["content"]} for msg in messages],
+            "stream": stream
+        }, options)
+    
+    @staticmethod
+    def timings(data: Dict) -> Dict:
+        """Durations from Ollama's final response, converted from nanoseconds to seconds"""
+        timings = {
+            "load_duration": data.get("load_duration", 0) / 1e9,
+            "prompt_eval_count": data.get("prompt_eval_count", 0),
+            "prompt_eval_duration": data.get("prompt_eval_duration", 0) / 1e9,
+            "eval_count": data.get("eval_count", 0),
+            "eval_duration": data.get("eval_duration", 0) / 1e9,
+            "total_duration": data.get("total_duration", 0) / 1e9
+        }
+        eval_rate = timings["eval_count"] / timings["eval_duration"] if timings["eval_duration"] else 0.0
+        timings["eval_rate"] = round(eval_rate, 1)
+        return timings
+    
+    def final_info(self, data: Dict) -> Dict:
+        return {
+            "usage": {
+                "prompt_tokens": data.get("prompt_eval_count", 0),
+                "completion_tokens": data.get("eval_count", 0)
+            },
+            "timings": self.timings(data)
+        }
+    
+    def extract_text(self, data: Dict) -> str:
+        return (data.get("message") or {}).get("content", "")
+    
+    def parse_response(self, data: Dict) -> Dict:
+        if data.get("error"):
+            raise BackendError(data["error"])
+        result = {
+            "model": data.get("model"),
+            "choices": [{"message": {"role": "assistant", "content": self.extract_text(data)}}]
+        }
+        result.update(self.final_info(data))
+        return result
+    
+    def parse_stream_line(self, line: str) -> Tuple[Optional[str], Optional[Dict], bool]:
+        chunk = json.loads(line)
+        if chunk.get("error"):
+            raise BackendError(chunk["error"])
+        done = bool(chunk.get("done"))
+        return self.extract_text(chunk), self.final_info(chunk) if done else None, done
+
+class OllamaGenerateBackend(OllamaChatBackend):
+    """Local Ollama /api/generate driver (single prompt, NDJSON streaming)"""
+    
+    def endpoint(self, stream: bool) -> str:
+        return f"{self.base_url}/api/generate"
+    
+    def build_payload(self, messages: List[Dict], model: str, stream: bool, options: Dict) -> Dict:
+        system = "\n\n".join(msg["content"] for msg in messages if msg["role"] == "system")
+        turns = [msg for msg in messages if msg["role"] != "system"]
+        if len(turns) == 1:
+            prompt = turns[0]["content"]
+        else:
+            prompt = "\n\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in turns)
+        payload = {"model": model, "prompt": prompt, "stream": stream}
+        if system:
+            payload["system"] = system
+        if options.get("context"):
+            # Token state from an earlier reply: only the new prompt is evaluated
+            payload["context"] = options["context"]
+        return self.build_options(payload, options)
+    
+    def extract_text(self, data: Dict) -> str:
+        return data.get("response", "")
+    
+    def final_info(self, data: Dict) -> Dict:
+        info = super().final_info(data)
+        if data.get("context"):
+            info["context"] = data["context"]
+        return info
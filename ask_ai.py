@@ -1,36 +1,98 @@
 import os
-import requests
+from ai_backend import OllamaGenerateBackend
 
-def read_files_and_ask(question, directory="./"):
-    # Collect all Python files
-    context = ""
+FILE_TYPES = ('.py', '.js', '.json', '.txt')  # Add file types you want
+IGNORED_DIRS = {'.git', 'node_modules', '__pycache__', 'dist', 'build', '.venv', 'venv', '.ai_cache'}
+IGNORED_FILES = {'package-lock.json', 'yarn.lock'}
+MODEL = "deepseek-coder:6.7b"  # Your best code model
+NUM_CTX = 16384  # Context window requested from Ollama for MODEL
+ANSWER_TOKENS = 4096  # Part of the window left free for the answer
+BYTES_PER_TOKEN = 3  # Conservative for source code, which tokenizes densely
+MAX_FILE_BYTES = 16000   # Per-file budget, larger files are truncated
+MAX_TOTAL_BYTES = (NUM_CTX - ANSWER_TOKENS) * BYTES_PER_TOKEN  # Total budget, keeps the prompt inside NUM_CTX
+KEEP_ALIVE = "30m"  # Keep the model (and its prompt cache) loaded between questions
+
+def iter_project_files(directory):
+    """Walk the tree, skipping ignored/hidden directories and unwanted files"""
     for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.endswith(('.py', '.js', '.json', '.txt')):  # Add file types you want
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        context += f"\n=== {file_path} ===\n{content}\n"
-                        print(f"Added: {file_path}")  # Show what files are being read
-                except Exception as e:
-                    print(f"Could not read {file_path}: {e}")
-    
-    # Send to Ollama
-    response = requests.post(
-        "http://localhost:11434/api/generate",
-        json={
-            "model": "deepseek-coder:6.7b",  # Your best code model
-            "prompt": f"Here are my files:\n{context}\n\nQuestion: {question}",
-            "stream": False
-        }
-    )
-    
-    return response.json()["response"]
+        # Prune in place so os.walk never descends into ignored directories
+        dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS and not d.startswith('.'))
+        for file in sorted(files):
+            if file.endswith(FILE_TYPES) and file not in IGNORED_FILES:
+                yield os.path.join(root, file)
+
+def iter_context_sections(directory, max_file_bytes=MAX_FILE_BYTES, max_total_bytes=MAX_TOTAL_BYTES):
+    """Yield one context section per file until the total byte budget is spent"""
+    total = 0
+    for file_path in iter_project_files(directory):
+        remaining = max_total_bytes - total
+        if remaining <= 0:
+            print(f"Context budget of {max_total_bytes} bytes reached, skipping remaining files")
+            return
+        try:
+            # Budgets are in bytes, so read bytes; a multi-byte character cut at the limit is dropped
+            with open(file_path, 'rb') as f:
+                content = f.read(min(max_file_bytes, remaining)).decode('utf-8', errors='ignore')
+                truncated = f.read(1) != b""
+        except Exception as e:
+            print(f"Could not read {file_path}: {e}")
+            continue
+
+        section = f"\n=== {file_path}{' (truncated)' if truncated else ''} ===\n{content}\n"
+        total += len(section.encode('utf-8'))
+        print(f"Added: {file_path}")  # Show what files are being read
+        yield section
+
+def stream_ollama_response(prompt, model=MODEL, context=None, state=None):
+    """Yield response tokens from Ollama's /api/generate; state receives the new context and timings"""
+    backend = OllamaGenerateBackend()
+    metrics = state if state is not None else {}
+    yield from backend.stream_chat([{"role": "user", "content": prompt}], model, metrics=metrics,
+                                   context=context, num_ctx=NUM_CTX, keep_alive=KEEP_ALIVE)
+
+def print_answer(prompt, context=None):
+    """Stream one answer to the terminal and return (answer, new context)"""
+    print("\nAI Response:")
+    state = {}
+    parts = []
+    for token in stream_ollama_response(prompt, context=context, state=state):
+        print(token, end="", flush=True)
+        parts.append(token)
+    print()
+
+    timings = state.get("provider") or {}
+    if timings:
+        print(f"(evaluated {timings['prompt_eval_count']} prompt tokens in {timings['prompt_eval_duration']:.1f}s, "
+              f"answered at {timings['eval_rate']} tok/s)")
+    return "".join(parts), state.get("context")
+
+def read_files_and_ask(question, directory="./", max_file_bytes=MAX_FILE_BYTES, max_total_bytes=MAX_TOTAL_BYTES):
+    # Collect project files within the byte budgets
+    context = "".join(iter_context_sections(directory, max_file_bytes, max_total_bytes))
+
+    # Send to Ollama and print the answer as it streams in
+    prompt = f"Here are my files:\n{context}\n\nQuestion: {question}"
+    answer, _ = print_answer(prompt)
+    return answer
+
+def chat_about_files(directory="./", max_file_bytes=MAX_FILE_BYTES, max_total_bytes=MAX_TOTAL_BYTES):
+    """Ingest the project once, then answer follow-ups from Ollama's returned context"""
+    question = input("What do you want to ask about your code? ")
+    files = "".join(iter_context_sections(directory, max_file_bytes, max_total_bytes))
+    answer, context = print_answer(f"Here are my files:\n{files}\n\nQuestion: {question}")
+
+    while True:
+        question = input("\nFollow-up question (Enter to quit): ").strip()
+        if not question:
+            break
+        if not context:
+            # No token state came back (older Ollama or a failed call): fall back to a full prompt
+            answer, context = print_answer(f"Here are my files:\n{files}\n\nQuestion: {question}")
+        else:
+            # Only the new question is evaluated; the files are already in the context state
+            answer, context = print_answer(f"Question: {question}", context=context)
+    return answer
 
 # Example usage:
 if __name__ == "__main__":
-    question = input("What do you want to ask about your code? ")
-    answer = read_files_and_ask(question, "./")  # Current directory
-    print("\nAI Response:")
-    print(answer)
\ No newline at end of file
+    chat_about_files("./")  # Current directory, answers are printed as they stream
@@ -5,58 +5,606 @@ All-in-One Single File Version
 """
 
 import os
-import requests
 import json
 import glob
 import shutil
 import time
 import re
 from datetime import datetime
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterator, Tuple, Callable
 import difflib
+import random
 import hashlib
 import pickle
+import sqlite3
 import concurrent.futures
-from threading import Lock
+import asyncio
+import functools
+import ast
+from contextlib import contextmanager
+from threading import Lock, Event, Thread
+import fnmatch
+from ai_backend import (OpenRouterBackend, RateLimiter, ModelRouter, Deadline, TokenBudget, StreamHandle,
+                        OPENROUTER_URL)
+
+# Bump whenever system prompts or prompt templates change, so old cached answers stop matching
+PROMPT_TEMPLATE_VERSION = 1
 
 # ==================== UTILITY CLASSES ====================
 
 class CacheManager:
-    """Intelligent caching system for AI responses"""
+    """Intelligent caching system for AI responses, bounded by size, entry count and TTL"""
+    
+    INDEX_FILE = "index.json"
     
-    def __init__(self, cache_dir=".ai_cache"):
+    def __init__(self, cache_dir=".ai_cache", max_bytes: int = 200 * 1024 * 1024, max_entries: int = 5000,
+                 default_ttl: Optional[float] = 7 * 86400, ttls: Optional[Dict] = None):
         self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl  # seconds, None = never expires
+        self.ttls = ttls or {}  # {"models": {model: seconds}, "features": {feature: seconds}}
+        self.index = {}  # cache_key -> {"size", "accessed", "expires"}
+        self.lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0, "evicted": 0}
+        self.on_remove = None  # called with each expired or evicted key, e.g. to drop it from a memory tier
         self.ensure_cache_dir()
+        self.compact()
     
     def ensure_cache_dir(self):
         """Create cache directory if it doesn't exist"""
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
     
-    def get_cache_key(self, prompt: str, model: str) -> str:
-        """Generate cache key from prompt and model"""
-        key_string = f"{prompt}_{model}"
-        return hashlib.md5(key_string.encode()).hexdigest()
+    def cache_file(self, cache_key: str) -> str:
+        return os.path.join(self.cache_dir, f"{cache_key}.pkl")
+    
+    def ttl_for(self, model: Optional[str] = None, feature: Optional[str] = None) -> Optional[float]:
+        """Feature TTL beats model TTL beats the default"""
+        features = self.ttls.get("features", {})
+        models = self.ttls.get("models", {})
+        if feature in features:
+            return features[feature]
+        if model in models:
+            return models[model]
+        return self.default_ttl
+    
+    def load_index(self) -> Dict:
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_index(self):
+        """Persist the index atomically (caller holds the lock)"""
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        try:
+            with open(index_path + ".tmp", 'w') as f:
+                json.dump(self.index, f)
+            os.replace(index_path + ".tmp", index_path)
+        except Exception as e:
+            print(f"Cache index write error: {e}")
+    
+    def compact(self):
+        """Startup pass: reconcile the index with the directory, drop expired entries, enforce the limits"""
+        saved = self.load_index()
+        now = time.time()
+        with self.lock:
+            self.index = {}
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".pkl"):
+                    continue
+                cache_key = name[:-4]
+                try:
+                    stat = os.stat(self.cache_file(cache_key))
+                except OSError:
+                    continue
+                # Files from before the index existed age from their modification time
+                entry = saved.get(cache_key) or {
+                    "accessed": stat.st_mtime,
+                    "expires": stat.st_mtime + self.default_ttl if self.default_ttl is not None else None
+                }
+                entry["size"] = stat.st_size
+                self.index[cache_key] = entry
+            
+            for cache_key, entry in list(self.index.items()):
+                if entry["expires"] is not None and entry["expires"] <= now:
+                    self.remove(cache_key)
+                    self.stats["expired"] += 1
+            self.evict()
+            self.save_index()
+        if self.stats["expired"] or self.stats["evicted"]:
+            print(f"🧹 Cache compacted: {self.stats['expired']} expired, {self.stats['evicted']} evicted, "
+                  f"{len(self.index)} entries kept")
+    
+    def remove(self, cache_key: str):
+        """Drop one entry and its file (caller holds the lock)"""
+        self.index.pop(cache_key, None)
+        try:
+            os.remove(self.cache_file(cache_key))
+        except OSError:
+            pass
+        if self.on_remove:
+            self.on_remove(cache_key)
+    
+    def evict(self):
+        """Remove least recently used entries until both limits hold (caller holds the lock)"""
+        total = sum(entry["size"] for entry in self.index.values())
+        if len(self.index) <= self.max_entries and total <= self.max_bytes:
+            return
+        for cache_key in sorted(self.index, key=lambda k: self.index[k]["accessed"]):
+            if len(self.index) <= self.max_entries and total <= self.max_bytes:
+                break
+            total -= self.index[cache_key]["size"]
+            self.remove(cache_key)
+            self.stats["evicted"] += 1
     
     def get_cached_response(self, cache_key: str) -> Optional[Dict]:
         """Retrieve cached response"""
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.pkl")
-        if os.path.exists(cache_file):
-            try:
-                with open(cache_file, 'rb') as f:
-                    return pickle.load(f)
-            except Exception as e:
-                print(f"Cache read error: {e}")
+        entry = self.get_cached_entry(cache_key)
+        return entry[0] if entry else None
+    
+    def get_cached_entry(self, cache_key: str) -> Optional[Tuple[Dict, Optional[float]]]:
+        """Cached response together with its expiry time"""
+        with self.lock:
+            entry = self.index.get(cache_key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry["expires"] is not None and entry["expires"] <= time.time():
+                self.remove(cache_key)
+                self.save_index()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            entry["accessed"] = time.time()  # persisted with the next write
+            expires = entry["expires"]
+        
+        try:
+            with open(self.cache_file(cache_key), 'rb') as f:
+                response = pickle.load(f)
+            self.stats["hits"] += 1
+            return response, expires
+        except Exception as e:
+            print(f"Cache read error: {e}")
+            with self.lock:
+                self.remove(cache_key)
+                self.stats["misses"] += 1
         return None
     
-    def cache_response(self, cache_key: str, response: Dict):
+    def cache_response(self, cache_key: str, response: Dict, model: Optional[str] = None,
+                       feature: Optional[str] = None):
         """Cache response to file"""
-        cache_file = os.path.join(self.cache_dir, f"{cache_key}.pkl")
         try:
-            with open(cache_file, 'wb') as f:
-                pickle.dump(response, f)
+            data = pickle.dumps(response)
+            with open(self.cache_file(cache_key), 'wb') as f:
+                f.write(data)
         except Exception as e:
             print(f"Cache write error: {e}")
+            return
+        
+        now = time.time()
+        ttl = self.ttl_for(model, feature)
+        with self.lock:
+            self.index[cache_key] = {
+                "size": len(data),
+                "accessed": now,
+                "expires": now + ttl if ttl is not None else None
+            }
+            self.stats["writes"] += 1
+            self.evict()
+            self.save_index()
+    
+    def get_stats(self) -> Dict:
+        """Entry count, bytes on disk and hit/miss/eviction counters"""
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                entries=len(self.index),
+                bytes=sum(entry["size"] for entry in self.index.values()),
+                hit_rate=self.stats["hits"] / lookups if lookups else 0.0
+            )
+    
+    def close(self):
+        """Persist access times recorded since the last write"""
+        with self.lock:
+            self.save_index()
+
+class SQLiteCacheManager(CacheManager):
+    """Response cache in one SQLite file (WAL mode) with batched writes, shared by threads and processes"""
+    
+    DB_FILE = "cache.sqlite3"
+    
+    def __init__(self, cache_dir=".ai_cache", batch_size: int = 20, flush_interval: float = 2.0, **limits):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = {}  # cache_key -> row waiting for the next batched write
+        self.pending_access = {}  # cache_key -> access time waiting for the next batched write
+        self.last_flush = time.time()
+        self.db = None
+        super().__init__(cache_dir, **limits)
+    
+    def connect(self):
+        # One connection shared by all threads, serialized by self.lock; WAL lets other processes read while we write
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, self.DB_FILE), timeout=10, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response BLOB NOT NULL, size INTEGER NOT NULL, "
+            "accessed REAL NOT NULL, expires REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.db.commit()
+    
+    def compact(self):
+        """Startup pass: import legacy .pkl files, drop expired rows, enforce the limits"""
+        with self.lock:
+            self.connect()
+            imported = self.import_pickles()
+            with self.db:
+                self.stats["expired"] += self.db.execute(
+                    "DELETE FROM responses WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)
+                ).rowcount
+            self.evict()
+        if imported:
+            print(f"📦 Moved {imported} cached responses into {self.DB_FILE}")
+        if self.stats["expired"] or self.stats["evicted"]:
+            print(f"🧹 Cache compacted: {self.stats['expired']} expired, {self.stats['evicted']} evicted")
+    
+    def import_pickles(self) -> int:
+        """Move per-file cache entries from the file backend into the database (caller holds the lock)"""
+        saved = self.load_index()
+        rows = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pkl"):
+                continue
+            cache_key = name[:-4]
+            try:
+                with open(self.cache_file(cache_key), 'rb') as f:
+                    data = f.read()
+                mtime = os.path.getmtime(self.cache_file(cache_key))
+            except OSError:
+                continue
+            entry = saved.get(cache_key) or {
+                "accessed": mtime,
+                "expires": mtime + self.default_ttl if self.default_ttl is not None else None
+            }
+            rows.append((cache_key, data, len(data), entry["accessed"], entry["expires"]))
+        
+        if rows:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", rows)
+            for row in rows:
+                os.remove(self.cache_file(row[0]))
+            if os.path.exists(os.path.join(self.cache_dir, self.INDEX_FILE)):
+                os.remove(os.path.join(self.cache_dir, self.INDEX_FILE))
+        return len(rows)
+    
+    def flush(self):
+        """Write pending responses and access times in one transaction (caller holds the lock)"""
+        if self.pending or self.pending_access:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                    list(self.pending.values()))
+                self.db.executemany("UPDATE responses SET accessed = ? WHERE key = ?",
+                                    [(accessed, key) for key, accessed in self.pending_access.items()])
+            self.pending.clear()
+            self.pending_access.clear()
+            self.evict()
+        self.last_flush = time.time()
+    
+    def evict(self):
+        """Remove least recently used rows until both limits hold (caller holds the lock)"""
+        count, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        doomed = []
+        for cache_key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((cache_key,))
+            count -= 1
+            total -= size
+        with self.db:
+            self.db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.stats["evicted"] += len(doomed)
+        if self.on_remove:
+            for (cache_key,) in doomed:
+                self.on_remove(cache_key)
+    
+    def get_cached_entry(self, cache_key: str) -> Optional[Tuple[Dict, Optional[float]]]:
+        """Cached response and expiry time (pending writes first, then the database)"""
+        now = time.time()
+        with self.lock:
+            if cache_key in self.pending:
+                data, expires = self.pending[cache_key][1], self.pending[cache_key][4]
+            else:
+                row = self.db.execute("SELECT response, expires FROM responses WHERE key = ?",
+                                      (cache_key,)).fetchone()
+                if row is None:
+                    self.stats["misses"] += 1
+                    return None
+                data, expires = row
+            
+            if expires is not None and expires <= now:
+                self.pending.pop(cache_key, None)
+                with self.db:
+                    self.db.execute("DELETE FROM responses WHERE key = ?", (cache_key,))
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                if self.on_remove:
+                    self.on_remove(cache_key)
+                return None
+            self.pending_access[cache_key] = now
+        
+        try:
+            response = pickle.loads(data)
+            self.stats["hits"] += 1
+            return response, expires
+        except Exception as e:
+            print(f"Cache read error: {e}")
+            self.stats["misses"] += 1
+        return None
+    
+    def cache_response(self, cache_key: str, response: Dict, model: Optional[str] = None,
+                       feature: Optional[str] = None):
+        """Queue a response; the batch is written once it is full or flush_interval has passed"""
+        try:
+            data = pickle.dumps(response)
+        except Exception as e:
+            print(f"Cache write error: {e}")
+            return
+        
+        now = time.time()
+        ttl = self.ttl_for(model, feature)
+        with self.lock:
+            self.pending[cache_key] = (cache_key, data, len(data), now, now + ttl if ttl is not None else None)
+            self.stats["writes"] += 1
+            if len(self.pending) >= self.batch_size or now - self.last_flush >= self.flush_interval:
+                try:
+                    self.flush()
+                except sqlite3.Error as e:
+                    print(f"Cache write error: {e}")
+    
+    def get_stats(self) -> Dict:
+        """Entry count, bytes on disk and hit/miss/eviction counters"""
+        with self.lock:
+            self.flush()
+            entries, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=entries, bytes=total,
+                        hit_rate=self.stats["hits"] / lookups if lookups else 0.0)
+    
+    def close(self):
+        """Write anything still pending and release the database"""
+        with self.lock:
+            if self.db is not None:
+                try:
+                    self.flush()
+                except sqlite3.Error as e:
+                    print(f"Cache write error: {e}")
+                self.db.close()
+                self.db = None
+
+class TieredCache:
+    """In-memory LRU of decoded responses in front of a disk cache, with per-tier and per-feature counters"""
+    
+    def __init__(self, disk: CacheManager, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024):
+        self.disk = disk
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()  # cache_key -> (response, size, expires), most recently used last
+        self.memory_bytes = 0
+        self.lock = Lock()
+        self.tiers = {tier: {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0, "time_saved": 0.0}
+                      for tier in ("memory", "disk")}
+        self.features = {}  # feature -> {"memory_hits", "disk_hits", "misses", "time_saved"}
+        disk.on_remove = self.forget  # an entry the disk expires or evicts must not live on in memory
+    
+    def feature_stats(self, feature: Optional[str]) -> Dict:
+        return self.features.setdefault(feature or "other",
+                                        {"memory_hits": 0, "disk_hits": 0, "misses": 0, "time_saved": 0.0})
+    
+    def count_hit(self, tier: str, feature: Optional[str], response: Dict, size: int, lookup_time: float):
+        """Credit a hit with the generation time it avoided (caller holds the lock)"""
+        saved = max(0.0, response.get("generation_seconds", 0.0) - lookup_time)
+        self.tiers[tier]["hits"] += 1
+        self.tiers[tier]["bytes"] += size
+        self.tiers[tier]["time_saved"] += saved
+        stats = self.feature_stats(feature)
+        stats[f"{tier}_hits"] += 1
+        stats["time_saved"] += saved
+    
+    def remember(self, cache_key: str, response: Dict, size: int, expires: Optional[float]):
+        """Put a response in the memory tier and evict LRU entries over the limits (caller holds the lock)"""
+        self.drop(cache_key)
+        if size > self.max_bytes:
+            return
+        self.memory[cache_key] = (response, size, expires)
+        self.memory_bytes += size
+        while len(self.memory) > self.max_entries or self.memory_bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted_size
+            self.tiers["memory"]["evictions"] += 1
+    
+    def drop(self, cache_key: str):
+        """Remove a memory entry if present (caller holds the lock)"""
+        if cache_key in self.memory:
+            self.memory_bytes -= self.memory.pop(cache_key)[1]
+    
+    def forget(self, cache_key: str):
+        """Disk tier callback for expired or evicted keys"""
+        with self.lock:
+            self.drop(cache_key)
+    
+    def get_cached_response(self, cache_key: str, feature: Optional[str] = None,
+                            record: bool = True) -> Optional[Dict]:
+        """Memory first, then disk (promoting the hit); record=False for internal re-checks"""
+        started = time.perf_counter()
+        with self.lock:
+            if cache_key in self.memory:
+                response, size, expires = self.memory[cache_key]
+                if expires is not None and expires <= time.time():
+                    self.drop(cache_key)  # the disk tier drops its copy on its own lookup
+                else:
+                    self.memory.move_to_end(cache_key)
+                    if record:
+                        self.count_hit("memory", feature, response, size, time.perf_counter() - started)
+                    return response
+            if record:
+                self.tiers["memory"]["misses"] += 1
+        
+        entry = self.disk.get_cached_entry(cache_key)
+        with self.lock:
+            if entry is None:
+                if record:
+                    self.tiers["disk"]["misses"] += 1
+                    self.feature_stats(feature)["misses"] += 1
+                return None
+            response, expires = entry
+            size = len(pickle.dumps(response))
+            self.remember(cache_key, response, size, expires)
+            if record:
+                self.count_hit("disk", feature, response, size, time.perf_counter() - started)
+        return response
+    
+    def cache_response(self, cache_key: str, response: Dict, model: Optional[str] = None,
+                       feature: Optional[str] = None, generation_seconds: Optional[float] = None):
+        """Write through both tiers; generation_seconds is what a later hit saves"""
+        if generation_seconds is not None:
+            response = dict(response, generation_seconds=round(generation_seconds, 3))
+        ttl = self.disk.ttl_for(model, feature)
+        expires = time.time() + ttl if ttl is not None else None
+        self.disk.cache_response(cache_key, response, model, feature)
+        with self.lock:
+            self.remember(cache_key, response, len(pickle.dumps(response)), expires)
+    
+    def get_stats(self) -> Dict:
+        """Counters per tier and per feature, plus the disk backend's own totals"""
+        disk = self.disk.get_stats()
+        with self.lock:
+            tiers = {tier: dict(stats) for tier, stats in self.tiers.items()}
+            tiers["memory"].update(entries=len(self.memory), stored_bytes=self.memory_bytes)
+            tiers["disk"].update(evictions=disk["evicted"], expired=disk["expired"],
+                                 entries=disk["entries"], stored_bytes=disk["bytes"])
+            lookups = tiers["memory"]["hits"] + tiers["memory"]["misses"]
+            hits = tiers["memory"]["hits"] + tiers["disk"]["hits"]
+            return {
+                "tiers": tiers,
+                "features": {feature: dict(stats) for feature, stats in self.features.items()},
+                "lookups": lookups,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "time_saved": tiers["memory"]["time_saved"] + tiers["disk"]["time_saved"]
+            }
+    
+    def close(self):
+        self.disk.close()
+
+class PatchEngine:
+    """Parse and apply search/replace or unified-diff edits from AI responses"""
+    
+    SEARCH_REPLACE_PATTERN = re.compile(
+        r'^<{7} SEARCH[ \t]*\n(.*?)^={7}[ \t]*\n(.*?)^>{7} REPLACE[ \t]*$',
+        re.DOTALL | re.MULTILINE
+    )
+    
+    FORMAT_INSTRUCTIONS = """Do NOT return the whole file. Return only the changes as SEARCH/REPLACE blocks:
+
+<<<<<<< SEARCH
+exact lines copied from the current file
+=======
+the lines that replace them
+>>>>>>> REPLACE
+
+Rules:
+1. SEARCH must match the current file exactly (including indentation) and be unique in it.
+2. Include just enough surrounding lines to make each SEARCH unique.
+3. Use one block per separate change, in file order.
+4. No explanations outside the blocks."""
+    
+    def parse_edits(self, response_text: str) -> List[Tuple[str, str]]:
+        """Extract (search, replace) pairs from SEARCH/REPLACE blocks or unified diff hunks"""
+        edits = [
+            (search[:-1] if search.endswith('\n') else search,
+             replace[:-1] if replace.endswith('\n') else replace)
+            for search, replace in self.SEARCH_REPLACE_PATTERN.findall(response_text)
+        ]
+        return edits or self.parse_unified_diff(response_text)
+    
+    def parse_unified_diff(self, response_text: str) -> List[Tuple[str, str]]:
+        """Turn unified diff hunks into (search, replace) pairs using their context lines"""
+        edits = []
+        old_lines, new_lines = None, None
+        
+        def close_hunk():
+            # Blank lines before prose or end of text are not real context
+            while old_lines and new_lines and old_lines[-1] == '' and new_lines[-1] == '':
+                old_lines.pop()
+                new_lines.pop()
+            edits.append(('\n'.join(old_lines), '\n'.join(new_lines)))
+        
+        for line in response_text.split('\n'):
+            if line.startswith('@@'):
+                if old_lines is not None:
+                    close_hunk()
+                old_lines, new_lines = [], []
+            elif old_lines is None or line.startswith(('---', '+++', '\\')):
+                continue
+            elif line.startswith('-'):
+                old_lines.append(line[1:])
+            elif line.startswith('+'):
+                new_lines.append(line[1:])
+            elif line.startswith(' ') or line == '':
+                old_lines.append(line[1:])
+                new_lines.append(line[1:])
+            else:
+                # Anything else (closing ``` or prose) ends the current hunk
+                close_hunk()
+                old_lines, new_lines = None, None
+        
+        if old_lines is not None:
+            close_hunk()
+        return [(old, new) for old, new in edits if old.strip() or new.strip()]
+    
+    def apply_edit(self, content: str, search: str, replace: str) -> Optional[str]:
+        """Apply one edit if its search lines match exactly one place in the file"""
+        if not search.strip():
+            return None
+        
+        lines = content.split('\n')
+        search_lines = search.split('\n')
+        n = len(search_lines)
+        
+        # Exact whole-line match first, then tolerate trailing whitespace differences
+        for normalize in (lambda line: line, str.rstrip):
+            target = [normalize(line) for line in search_lines]
+            matches = [
+                i for i in range(len(lines) - n + 1)
+                if [normalize(line) for line in lines[i:i + n]] == target
+            ]
+            if len(matches) == 1:
+                start = matches[0]
+                # An empty REPLACE deletes the lines rather than leaving a blank one
+                replace_lines = [] if replace == '' else replace.split('\n')
+                return '\n'.join(lines[:start] + replace_lines + lines[start + n:])
+            if len(matches) > 1:
+                return None  # Ambiguous
+        return None
+    
+    def apply_edits(self, content: str, edits: List[Tuple[str, str]]) -> Tuple[str, List[int]]:
+        """Apply edits in order, returning the new content and indexes of hunks that failed"""
+        failed = []
+        for i, (search, replace) in enumerate(edits):
+            updated = self.apply_edit(content, search, replace)
+            if updated is None:
+                failed.append(i)
+            else:
+                content = updated
+        return content, failed
 
 class StaticAnalyzer:
     """Advanced static code analysis engine"""
@@ -276,6 +824,353 @@ class ParallelProcessor:
         
         return results
 
+class ProjectPrefetcher:
+    """Background worker that keeps expensive project reads warm while the menu waits for input"""
+    
+    def __init__(self, refresh_interval: float = 60, debounce: float = 0.5):
+        self.loaders = {}  # name -> callable producing the value
+        self.values = {}  # name -> (generation, value)
+        self.name_locks = {}
+        self.generation = 0
+        self.refresh_interval = refresh_interval  # also catches edits made outside the assistant
+        self.debounce = debounce
+        self.lock = Lock()
+        self.wake = Event()
+        self.thread = None
+        self.stats = {"warm_hits": 0, "cold_loads": 0, "background_loads": 0}
+    
+    def register(self, name: str, loader: Callable):
+        self.loaders[name] = loader
+        self.name_locks[name] = Lock()
+    
+    def start(self):
+        """Start the worker (idempotent) and schedule a full warm-up"""
+        if self.thread is None:
+            self.thread = Thread(target=self.worker, name="project-prefetch", daemon=True)
+            self.thread.start()
+        self.wake.set()
+    
+    def invalidate(self):
+        """Mark every value stale (e.g. after a file write) and schedule a refresh"""
+        with self.lock:
+            self.generation += 1
+        self.wake.set()
+    
+    def fresh(self, name: str):
+        """(value, True) when the stored value matches the current generation (caller holds the lock)"""
+        entry = self.values.get(name)
+        if entry and entry[0] == self.generation:
+            return entry[1], True
+        return None, False
+    
+    def load(self, name: str, background: bool):
+        """Compute a value unless someone else already refreshed it; per-name lock avoids double work"""
+        with self.name_locks[name]:
+            with self.lock:
+                value, is_fresh = self.fresh(name)
+                if is_fresh:
+                    if not background:
+                        self.stats["warm_hits"] += 1
+                    return value
+                generation = self.generation
+            value = self.loaders[name]()
+            with self.lock:
+                self.values[name] = (generation, value)
+                self.stats["background_loads" if background else "cold_loads"] += 1
+            return value
+    
+    def get(self, name: str):
+        """Warm value if available, otherwise wait for the in-flight refresh or load it now"""
+        with self.lock:
+            value, is_fresh = self.fresh(name)
+            if is_fresh:
+                self.stats["warm_hits"] += 1
+                return value
+        return self.load(name, background=False)
+    
+    def worker(self):
+        while True:
+            if not self.wake.wait(self.refresh_interval):
+                self.invalidate()  # periodic refresh
+            self.wake.clear()
+            time.sleep(self.debounce)  # let a burst of writes settle first
+            for name in list(self.loaders):
+                try:
+                    self.load(name, background=True)
+                except Exception:
+                    pass  # a foreground get() will retry and surface the error
+
+# MinHash hash family for the semantic cache; the seed is fixed because signatures are persisted
+MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240611)
+MINHASH_COEFFICIENTS = [(_minhash_rng.randrange(1, MINHASH_PRIME), _minhash_rng.randrange(MINHASH_PRIME))
+                        for _ in range(128)]
+
+class SemanticCache:
+    """Near-duplicate question cache: MinHash over content-word trigrams, scoped by feature and context"""
+    
+    # Filler, plus generic verbs and scope words that rarely change what is being asked
+    # ("configured" vs "set", "in this project"); compared both as typed and stemmed
+    STOPWORDS = {"a", "an", "the", "this", "that", "these", "those", "our", "my", "in", "on", "of", "for", "to",
+                 "is", "are", "be", "how", "does", "do", "what", "where", "when", "which", "who", "why", "please",
+                 "me", "about", "can", "you", "i", "it", "explain", "tell", "describe", "show", "get", "work",
+                 "happen", "configur", "set", "defin", "declar", "stor", "locat", "handl", "implement", "us",
+                 "mean", "project", "app", "cod", "codebas", "here", "file"}
+    
+    def __init__(self, path=".ai_cache/semantic.json", threshold: float = 0.7, max_entries: int = 500):
+        self.path = path
+        self.threshold = threshold  # estimated Jaccard similarity of the content-word trigrams
+        self.max_entries = max_entries
+        self.entries = []  # oldest first
+        self.lock = Lock()
+        self.stats = {"offered": 0, "accepted": 0, "refreshed": 0}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = []
+    
+    @staticmethod
+    def stem(word: str) -> str:
+        """Crude suffix stripping so "works"/"work" and "caching"/"cache" compare equal"""
+        for suffix in ("ing", "ed", "es", "s", "e"):
+            if word.endswith(suffix) and not word.endswith("ss") and len(word) - len(suffix) >= 3:
+                return word[:-len(suffix)]
+        return word
+    
+    @classmethod
+    def content_words(cls, text: str) -> List[str]:
+        """Stemmed words without punctuation, filler or generic words"""
+        words = re.sub(r"[^a-z0-9]+", " ", text.lower()).split()
+        return sorted({cls.stem(word) for word in words
+                       if word not in cls.STOPWORDS and cls.stem(word) not in cls.STOPWORDS})
+    
+    @staticmethod
+    def signature(words: List[str]) -> List[int]:
+        """MinHash over per-word character trigrams, robust to word order, extra words and typos"""
+        grams = {f" {word} "[i:i + 3] for word in words for i in range(len(word))} or {""}
+        values = [int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "big")
+                  for gram in grams]
+        return [min((a * value + b) % MINHASH_PRIME for value in values) for a, b in MINHASH_COEFFICIENTS]
+    
+    @staticmethod
+    def similarity(first: List[int], second: List[int]) -> float:
+        return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+    
+    @staticmethod
+    def same_word(first: str, second: str) -> bool:
+        """Equal, or a likely typo: same first letter and nearly the same spelling"""
+        if first == second:
+            return True
+        return (min(len(first), len(second)) >= 4 and first[0] == second[0]
+                and difflib.SequenceMatcher(None, first, second).ratio() >= 0.85)
+    
+    @classmethod
+    def swapped(cls, first: List[str], second: List[str]) -> bool:
+        """Whether each side has a word the other lacks: "admin" vs "worker", "XSS" vs "CSRF" """
+        return (any(not any(cls.same_word(word, other) for other in second) for word in first)
+                and any(not any(cls.same_word(word, other) for other in first) for word in second))
+    
+    def lookup(self, feature: str, context_key: str, question: str) -> Tuple[Optional[Dict], float]:
+        """Best earlier answer for the same feature and context, if it clears the threshold"""
+        words = self.content_words(question)
+        signature = self.signature(words)
+        best, best_score = None, 0.0
+        with self.lock:
+            for entry in self.entries:
+                if entry["feature"] != feature or entry["context"] != context_key:
+                    continue
+                other = self.content_words(entry["question"])
+                score = self.similarity(signature, entry.get("signature") or self.signature(other))
+                # Similar overall but a word was swapped for another: that word is the question
+                if score >= self.threshold and score > best_score and not self.swapped(words, other):
+                    best, best_score = entry, score
+        return best, best_score
+    
+    def store(self, feature: str, context_key: str, question: str, response: Dict, replaces: Optional[Dict] = None):
+        with self.lock:
+            if replaces in self.entries:
+                self.entries.remove(replaces)
+            self.entries.append({
+                "feature": feature,
+                "context": context_key,
+                "question": question,
+                "signature": self.signature(self.content_words(question)),
+                "response": response,
+                "timestamp": datetime.now().isoformat()
+            })
+            self.entries = self.entries[-self.max_entries:]
+            try:
+                with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f)
+                os.replace(self.path + ".tmp", self.path)
+            except Exception as e:
+                print(f"Semantic cache write error: {e}")
+
+class SingleFlight:
+    """Coalesce concurrent identical requests into one in-flight call (threads and asyncio)"""
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.in_flight = {}  # key -> concurrent.futures.Future
+        self.stats = {"calls": 0, "coalesced": 0}
+    
+    def join_or_lead(self, key: str) -> Tuple[concurrent.futures.Future, bool]:
+        """Return the future for key and whether the caller must produce its result"""
+        with self.lock:
+            self.stats["calls"] += 1
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self.in_flight[key] = future
+            return future, True
+    
+    def finish(self, key: str, future: concurrent.futures.Future, result=None, error: Optional[BaseException] = None):
+        """Publish the leader's outcome to every waiter and forget the key"""
+        with self.lock:
+            self.in_flight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def do(self, key: str, func: Callable) -> Tuple[Optional[Dict], bool]:
+        """Run func once per key; returns (result, shared) where shared means it was joined"""
+        future, leader = self.join_or_lead(key)
+        if not leader:
+            return future.result(), True
+        try:
+            result = func()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result, False
+    
+    async def do_async(self, key: str, coro_func: Callable) -> Tuple[Optional[Dict], bool]:
+        """Async variant of do(); waiters may be threads or coroutines"""
+        future, leader = self.join_or_lead(key)
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await coro_func()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result, False
+
+class AsyncAIClient:
+    """Asyncio LLM client with bounded global and per-model concurrency"""
+    
+    def __init__(self, assistant, max_concurrency=6, per_model_limits: Optional[Dict] = None):
+        self.assistant = assistant
+        self.max_concurrency = max_concurrency
+        self.per_model_limits = per_model_limits or {}
+        # Network I/O runs on the shared pooled transport; asyncio only schedules it
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+        self.global_semaphore = None
+        self.model_semaphores = {}
+    
+    def get_model_semaphore(self, model: str) -> asyncio.Semaphore:
+        """Per-model semaphore, created on first use inside the running loop"""
+        if model not in self.model_semaphores:
+            limit = self.per_model_limits.get(model, self.max_concurrency)
+            self.model_semaphores[model] = asyncio.Semaphore(limit)
+        return self.model_semaphores[model]
+    
+    async def ai_call(self, messages: List[Dict], model: str, max_retries: int = 3) -> Optional[Dict]:
+        """Async counterpart of robust_ai_call with the same retry/backoff rules"""
+        loop = asyncio.get_running_loop()
+        backend = self.assistant.backend
+        deadline = self.assistant.deadline
+        
+        for attempt in range(max_retries):
+            # Pace before taking a slot so queued requests don't hold concurrency
+            if backend.rate_limiter:
+                delay = backend.rate_limiter.reserve(model)
+                if delay > 0:
+                    if not deadline.allows(delay):
+                        return None
+                    await asyncio.sleep(delay)
+            
+            # Hold the slots only while a request is in flight, not during backoff
+            async with self.global_semaphore, self.get_model_semaphore(model):
+                if deadline.expired:
+                    return None
+                status, value = await loop.run_in_executor(
+                    self.executor,
+                    functools.partial(backend.attempt, messages, model, attempt, pace=False, deadline=deadline)
+                )
+            
+            if status == "ok":
+                return value
+            if status == "fail":
+                return None
+            if value and attempt < max_retries - 1:
+                if not deadline.allows(value):
+                    return None
+                await asyncio.sleep(value)
+        
+        return None
+    
+    async def cached_call(self, messages: List[Dict], model: str, max_retries: int = 3) -> Optional[Dict]:
+        """Async call that reads and fills the assistant's response cache"""
+        cache_manager = self.assistant.cache_manager
+        feature = self.assistant.current_feature
+        cache_key = self.assistant.request_fingerprint(messages, model)
+        cached_response = cache_manager.get_cached_response(cache_key, feature)
+        if cached_response:
+            return cached_response
+        
+        async def call():
+            # Re-check: an identical request may have finished since the first lookup
+            cached_response = cache_manager.get_cached_response(cache_key, feature, record=False)
+            if cached_response:
+                return cached_response
+            started = time.perf_counter()
+            response = await self.ai_call(self.assistant.token_budget.fit(messages, model), model, max_retries)
+            if response:
+                cache_manager.cache_response(cache_key, response, model, feature, time.perf_counter() - started)
+            return response
+        
+        response, _ = await self.assistant.single_flight.do_async(cache_key, call)
+        return response
+    
+    async def gather(self, requests_list: List[Tuple[List[Dict], str]], max_retries: int = 3,
+                     on_result: Optional[Callable] = None) -> List[Optional[Dict]]:
+        """Run many (messages, model) requests concurrently, preserving order"""
+        # Semaphores belong to the running loop, so recreate them per fan-out
+        self.global_semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.model_semaphores = {}
+        
+        async def run_one(index, messages, model):
+            try:
+                result = await self.cached_call(messages, model, max_retries)
+            except Exception as e:
+                print(f"❌ Request Error: {e}")
+                result = None
+            if on_result:
+                on_result(index, result)
+            return result
+        
+        return await asyncio.gather(*(
+            run_one(i, messages, model) for i, (messages, model) in enumerate(requests_list)
+        ))
+    
+    def run_many(self, requests_list: List[Tuple[List[Dict], str]], max_retries: int = 3,
+                 on_result: Optional[Callable] = None) -> List[Optional[Dict]]:
+        """Sync facade: fan out requests from regular menu methods"""
+        if not requests_list:
+            return []
+        return asyncio.run(self.gather(requests_list, max_retries, on_result))
+    
+    def close(self):
+        """Release worker threads"""
+        self.executor.shutdown(wait=False)
+
 # ==================== MAIN ASSISTANT CLASS ====================
 
 class AIAssistant:
@@ -284,8 +1179,68 @@ class AIAssistant:
         self.conversation_history = []
         self.config = self.load_config()
         self.session_actions = []  # Track all actions taken
-        self.cache_manager = CacheManager()
+        cache_class = SQLiteCacheManager if self.config["cache_backend"] == "sqlite" else CacheManager
+        self.cache_manager = TieredCache(
+            cache_class(
+                max_bytes=self.config["cache_max_mb"] * 1024 * 1024,
+                max_entries=self.config["cache_max_entries"],
+                default_ttl=self.config["cache_ttl_seconds"],
+                ttls=self.config["cache_ttls"]
+            ),
+            max_entries=self.config["memory_cache_entries"],
+            max_bytes=self.config["memory_cache_mb"] * 1024 * 1024
+        )
+        self.current_feature = None  # Menu feature being run, used for per-feature cache TTLs
+        self.semantic_cache = SemanticCache(
+            os.path.join(self.cache_manager.disk.cache_dir, "semantic.json"),
+            threshold=self.config["semantic_cache_threshold"],
+            max_entries=self.config["semantic_cache_entries"]
+        ) if self.config["semantic_cache_enabled"] else None
         self.static_analyzer = StaticAnalyzer()
+        self.patch_engine = PatchEngine()
+        self.hedge_executor = None  # Created on first hedged call
+        self.hedge_stats = {"calls": 0, "hedged": 0, "primary_wins": 0, "fallback_wins": 0}
+        self.hedge_lock = Lock()  # hedged calls run concurrently from batch and parallel features
+        self.single_flight = SingleFlight()
+        self.deadline = Deadline()  # Unbounded unless an operation sets a budget
+        self.prefetcher = ProjectPrefetcher(refresh_interval=self.config["prefetch_refresh_seconds"])
+        self.prefetcher.register("project_context", lambda: self.read_project_files_smart(verbose=False, use_prefetch=False))
+        self.prefetcher.register("component_context", lambda: self.read_context_intelligently(
+            "generate_component", verbose=False, use_prefetch=False))
+        self.prefetcher.register("file_index", self.build_file_index)
+        self.prefetcher.register("static_metrics", self.build_static_metrics)
+        self.rate_limiter = RateLimiter.shared(
+            requests_per_minute=self.config["rate_limit_rpm"],
+            burst=self.config["rate_limit_burst"],
+            per_model_limits=self.config["per_model_rate_limits"]
+        )
+        self.backend = OpenRouterBackend(
+            self.API_KEY,
+            pool_size=self.config["http_pool_size"],
+            http2=self.config["http2_enabled"],
+            rate_limiter=self.rate_limiter,
+            url=self.config["openrouter_url"]
+        )
+        if self.config["cassette_mode"]:
+            self.backend.use_cassette(
+                self.config["cassette_mode"], self.config["cassette_path"], self.config["replay_speed"]
+            )
+        self.token_budget = TokenBudget(
+            dict({m["id"]: m["context"] for m in self.config["router_models"]}, **self.config["context_windows"]),
+            reserve_output=self.config["reserve_output_tokens"]
+        )
+        self.router = ModelRouter(
+            self.config["router_models"],
+            self.backend.metrics,
+            latency_slo=self.config["latency_slo_seconds"],
+            max_error_rate=self.config["router_max_error_rate"],
+            task_min_tier=self.config["task_min_tier"]
+        )
+        self.async_client = AsyncAIClient(
+            self,
+            max_concurrency=self.config["max_concurrent_requests"],
+            per_model_limits=self.config["per_model_concurrency"]
+        )
     
     def load_config(self):
         """Load configuration from file or defaults"""
@@ -298,7 +1253,61 @@ class AIAssistant:
                 "src/components/BaseAdmin", "src/components/BaseUser", 
                 "src/components/BaseWorker", "src/components/common"
             ],
-            "preferred_extensions": [".jsx", ".js", ".ts", ".tsx", ".css", ".json"]
+            "preferred_extensions": [".jsx", ".js", ".ts", ".tsx", ".css", ".json"],
+            "openrouter_url": OPENROUTER_URL,
+            "http_pool_size": 10,
+            "http2_enabled": True,
+            "streaming_enabled": True,
+            "max_concurrent_requests": 6,
+            "per_model_concurrency": {
+                "meta-llama/llama-3-70b-instruct:nitro": 3
+            },
+            "rate_limit_rpm": 120,
+            "rate_limit_burst": 10,
+            "per_model_rate_limits": {},  # model -> requests per minute
+            "patch_edits_enabled": True,
+            "hedging_enabled": False,
+            "hedge_percentile": 95,
+            "hedge_min_samples": 5,
+            "hedge_default_delay": 30,  # seconds, used until enough latency history exists
+            "hedge_fallback_models": {
+                "meta-llama/llama-3-70b-instruct:nitro": "anthropic/claude-3-haiku:nitro",
+                "mistralai/mistral-7b-instruct:nitro": "anthropic/claude-3-haiku:nitro"
+            },
+            "context_windows": {},  # model -> tokens, on top of router_models and built-in defaults
+            "reserve_output_tokens": 1024,
+            "model_routing_enabled": True,
+            "latency_slo_seconds": 30,
+            "router_max_error_rate": 0.3,
+            "router_models": [  # tier 1 = cheapest/fastest, context in tokens
+                {"id": "mistralai/mistral-7b-instruct:nitro", "tier": 1, "context": 32768},
+                {"id": "anthropic/claude-3-haiku:nitro", "tier": 2, "context": 200000},
+                {"id": "meta-llama/llama-3-70b-instruct:nitro", "tier": 3, "context": 8192}
+            ],
+            "task_min_tier": {"generate": 1, "edit": 1, "analysis": 2, "debug": 2},
+            "cassette_mode": None,  # "record" or "replay" (or set LLM_CASSETTE_MODE)
+            "cassette_path": ".ai_cassettes/session.jsonl.gz",
+            "replay_speed": 0,  # 1 = recorded timing, 10 = ten times faster, 0 = instant
+            "cache_backend": "files",  # "files" (one pickle per response) or "sqlite" (single WAL database)
+            "memory_cache_entries": 256,
+            "memory_cache_mb": 32,
+            "cache_max_mb": 200,
+            "cache_max_entries": 5000,
+            "cache_ttl_seconds": 7 * 86400,  # null = never expire
+            "cache_ttls": {  # seconds per model or per menu feature (feature wins)
+                "models": {},
+                "features": {"project_health_monitoring": 86400, "dependency_graph_analyzer": 86400}
+            },
+            "semantic_cache_enabled": False,  # offer earlier answers to reworded questions
+            "semantic_cache_threshold": 0.7,  # MinHash similarity, 1.0 = same words after normalization
+            "semantic_cache_entries": 500,
+            "prefetch_enabled": True,
+            "prefetch_refresh_seconds": 60,
+            "operation_deadlines": {  # total seconds per long operation, null = unbounded
+                "code_review_assistant": 600,
+                "comprehensive_testing": 600,
+                "perform_migration": 1800
+            }
         }
         
         try:
@@ -323,11 +1332,34 @@ class AIAssistant:
         if len(self.conversation_history) > 15:  # Keep last 15 interactions
             self.conversation_history = self.conversation_history[-15:]
     
+    FIND_EXTENSIONS = ['*.jsx', '*.js', '*.css', '*.html', '*.json', '.md', '*.ts', '*.tsx']
+    
+    def build_file_index(self) -> List[str]:
+        """Every file directly inside the configured search paths"""
+        index = []
+        for path in self.config["search_paths"]:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    if os.path.isfile(os.path.join(path, name)):
+                        index.append(os.path.join(path, name))
+        return index
+    
     def find_file_by_name(self, partial_name: str) -> List[str]:
         """Find files by partial name search"""
-        extensions = ['*.jsx', '*.js', '*.css', '*.html', '*.json', '.md', '*.ts', '*.tsx']
+        extensions = self.FIND_EXTENSIONS
         found_files = []
         
+        if self.config["prefetch_enabled"]:
+            # Same matching as the glob below, but against the prefetched index
+            patterns = [f"*{partial_name}*{ext}" for ext in extensions]
+            found_files = [
+                path for path in self.prefetcher.get("file_index")
+                if any(fnmatch.fnmatchcase(os.path.basename(path), pattern) for pattern in patterns)
+            ]
+            if found_files:
+                return sorted(set(found_files))
+        
+        # Index miss (e.g. a file created outside the assistant): search the disk
         for path in self.config["search_paths"]:
             if os.path.exists(path):
                 for ext in extensions:
@@ -401,17 +1433,23 @@ class AIAssistant:
                 f.write(content)
             print(f"✅ Successfully wrote to {filename}")
             self.add_to_history("system", f"File written: {filename}", "file_write")
+            self.prefetcher.invalidate()
             return True
         except Exception as e:
             print(f"❌ Error writing to {filename}: {e}")
             return False
     
-    def read_context_intelligently(self, task_type: str) -> str:
+    def read_context_intelligently(self, task_type: str, verbose: bool = True, use_prefetch: bool = True) -> str:
         """Read context based on task type"""
         context = ""
         file_count = 0
         
         if task_type in ["generate_component", "modify_file"]:
+            if use_prefetch and self.config["prefetch_enabled"]:
+                context = self.prefetcher.get("component_context")
+                print(f"⚡ Component context ready ({context.count(chr(10) + '=== ')} files)")
+                return context
+            
             # Focus on component examples
             essential_files = ["package.json", "src/App.jsx", "src/main.jsx"]
             for file in essential_files:
@@ -422,13 +1460,15 @@ class AIAssistant:
                             if len(content) < 10000:
                                 context += f"\n=== {file} ===\n{content}\n"
                                 file_count += 1
-                                print(f"📄 Added: {file}")
+                                if verbose:
+                                    print(f"📄 Added: {file}")
                     except: pass
             
             # Read component examples
             component_files = []
             for root, dirs, files in os.walk("src/components"):
-                for file in files[:3]:  # Limit to 3 examples
+                dirs.sort()
+                for file in sorted(files)[:3]:  # Limit to 3 examples
                     if file.endswith((".jsx", ".js", ".css")):
                         component_files.append(os.path.join(root, file))
                         if len(component_files) >= 3: break
@@ -441,14 +1481,16 @@ class AIAssistant:
                         if len(content) < 5000:
                             context += f"\n=== {file_path} ===\n{content}\n"
                             file_count += 1
-                            print(f"📄 Added example: {file_path}")
+                            if verbose:
+                                print(f"📄 Added example: {file_path}")
                 except: pass
         
         else:
             # General project structure reading
-            return self.read_project_files_smart()
+            return self.read_project_files_smart(verbose, use_prefetch)
         
-        print(f"\n📊 Total context files: {file_count}")
+        if verbose:
+            print(f"\n📊 Total context files: {file_count}")
         return context
     
     def extract_code_from_response(self, response_text: str) -> str:
@@ -467,72 +1509,404 @@ class AIAssistant:
         
         return response_text.strip()
     
-    def robust_ai_call(self, messages: List[Dict], model: str, max_retries: int = 3) -> Optional[Dict]:
+    def robust_ai_call(self, messages: List[Dict], model: str, max_retries: int = 3,
+                       metrics: Optional[Dict] = None, hedge: bool = True, **options) -> Optional[Dict]:
         """AI call with retry logic and better error handling"""
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.API_KEY}",
-                        "HTTP-Referer": "http://localhost:3000",
-                        "X-Title": "Enhanced Code Assistant",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": model,
-                        "messages": messages,
-                        "temperature": 0.7
-                    },
-                    timeout=300
-                )
-                
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 429:  # Rate limited
-                    print(f"⏳ Rate limited. Waiting... (attempt {attempt + 1})")
-                    time.sleep(2 ** attempt)
-                    continue
-                else:
-                    print(f"❌ API Error: {response.status_code} - {response.text}")
-                    return None
-                    
-            except requests.exceptions.Timeout:
-                print(f"⏰ Timeout on attempt {attempt + 1}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)
-                    continue
-            except Exception as e:
-                print(f"❌ Request Error: {e}")
-                return None
+        # Hedging races the default sampling settings, so explicit options skip it
+        if hedge and not options and self.config["hedging_enabled"] and model in self.config["hedge_fallback_models"]:
+            return self.hedged_ai_call(messages, model, max_retries)
         
-        return None
+        return self.backend.chat(messages, model, max_retries, metrics=metrics, deadline=self.deadline, **options)
     
-    def cached_ai_call(self, messages: List[Dict], model: str, max_retries: int = 3) -> Optional[Dict]:
-        """AI call with intelligent caching"""
-        # Generate cache key from the last user message (most relevant)
-        user_messages = [msg for msg in messages if msg["role"] == "user"]
-        if user_messages:
-            last_user_message = user_messages[-1]["content"]
-            cache_key = self.cache_manager.get_cache_key(last_user_message, model)
-            
-            # Check cache first
-            cached_response = self.cache_manager.get_cached_response(cache_key)
-            if cached_response:
-                print("⚡ Cache hit! Returning cached response...")
-                return cached_response
+    def stream_ai_call(self, messages: List[Dict], model: str, max_retries: int = 3,
+                       metrics: Optional[Dict] = None, handle: Optional[StreamHandle] = None,
+                       **options) -> Iterator[str]:
+        """Yield response tokens as they arrive over the SSE stream"""
+        yield from self.backend.stream_chat(messages, model, max_retries, metrics=metrics, deadline=self.deadline,
+                                            handle=handle, **options)
+    
+    @contextmanager
+    def operation_deadline(self, operation: str):
+        """Give an operation its configured time budget; every nested AI call and retry honours it"""
+        seconds = self.config["operation_deadlines"].get(operation)
+        deadline = Deadline(seconds)
+        previous = self.deadline
+        self.deadline = deadline
+        if seconds:
+            print(f"⏱️  Time budget: {seconds}s")
+        try:
+            yield deadline
+        except KeyboardInterrupt:
+            # Ctrl+C cancels the remaining work; the caller still reports what finished
+            deadline.cancel()
+            print("\n🛑 Operation cancelled, reporting partial results...")
+        finally:
+            self.deadline = previous
+    
+    def render_streamed_call(self, messages: List[Dict], model: str, max_retries: int = 3,
+                             **options) -> Optional[Dict]:
+        """Print tokens as they stream in and return the assembled response"""
+        parts = []
+        metrics = {}
+        try:
+            for token in self.stream_ai_call(messages, model, max_retries, metrics=metrics, **options):
+                print(token, end="", flush=True)
+                parts.append(token)
+        except Exception as e:
+            print(f"\n❌ Stream Error: {e}")
+            return None
+        print()
         
-        # Make actual API call
-        response = self.robust_ai_call(messages, model, max_retries)
+        if not parts or not metrics:
+            return None
         
-        # Cache the response if successful
-        if response and user_messages:
-            self.cache_manager.cache_response(cache_key, response)
+        cached_note = f" ({metrics['cached_tokens']} cached)" if metrics.get("cached_tokens") else ""
+        print(f"\n⏱️  TTFT {metrics['ttft']:.2f}s | {metrics['input_tokens']} in{cached_note} / {metrics['output_tokens']} out tokens | "
+              f"{metrics['tokens_per_sec']} tok/s | total {metrics['latency']:.2f}s")
+        return {
+            "model": model,
+            "choices": [{"message": {"role": "assistant", "content": "".join(parts)}}],
+            "usage": {
+                "prompt_tokens": metrics["input_tokens"],
+                "completion_tokens": metrics["output_tokens"],
+                "cached_tokens": metrics["cached_tokens"]
+            }
+        }
+    
+    def hedge_delay(self, model: str) -> float:
+        """Latency percentile learned from this model's successful calls"""
+        latencies = sorted(self.backend.metrics.latencies(model))
+        if len(latencies) < self.config["hedge_min_samples"]:
+            return float(self.config["hedge_default_delay"])
+        index = max(0, int(len(latencies) * self.config["hedge_percentile"] / 100 + 0.999) - 1)
+        return latencies[min(index, len(latencies) - 1)]
+    
+    def collect_streamed_call(self, messages: List[Dict], model: str, max_retries: int,
+                              handle: StreamHandle) -> Optional[Dict]:
+        """Quietly assemble a streamed response, abandoning it once the handle is cancelled"""
+        parts = []
+        metrics = {}
+        stream = self.stream_ai_call(messages, model, max_retries, metrics=metrics, handle=handle)
+        try:
+            for token in stream:
+                if handle.cancelled:
+                    return None
+                parts.append(token)
+        except Exception as e:
+            if not handle.cancelled:  # an aborted loser's connection error is expected
+                print(f"❌ Stream Error ({model}): {e}")
+            return None
+        finally:
+            # Closing the generator closes the HTTP stream, so the provider stops generating
+            stream.close()
+        
+        if not parts or not metrics:
+            return None
+        return {
+            "model": model,
+            "choices": [{"message": {"role": "assistant", "content": "".join(parts)}}],
+            "usage": {"completion_tokens": metrics["output_tokens"]}
+        }
+    
+    def hedged_ai_call(self, messages: List[Dict], model: str, max_retries: int = 3) -> Optional[Dict]:
+        """Race a slow request against a fallback model and keep whichever finishes first"""
+        fallback = self.config["hedge_fallback_models"][model]
+        delay = self.hedge_delay(model)
+        with self.hedge_lock:
+            if self.hedge_executor is None:
+                self.hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+            self.hedge_stats["calls"] += 1
+        
+        # Handles let this thread abort a loser's connection, even before its first token arrives
+        handles = {model: StreamHandle(), fallback: StreamHandle()}
+        primary = self.hedge_executor.submit(
+            self.collect_streamed_call, messages, model, max_retries, handles[model]
+        )
+        done, _ = concurrent.futures.wait([primary], timeout=delay)
+        if done:
+            result = primary.result()
+            if result:
+                with self.hedge_lock:
+                    self.hedge_stats["primary_wins"] += 1
+            return result
+        
+        print(f"🏎️  {model} slower than {delay:.1f}s, hedging with {fallback}...")
+        with self.hedge_lock:
+            self.hedge_stats["hedged"] += 1
+        hedge = self.hedge_executor.submit(
+            self.collect_streamed_call, messages, fallback, max_retries, handles[fallback]
+        )
+        future_models = {primary: model, hedge: fallback}
+        pending = set(future_models)
+        result = None
+        winner = None
+        
+        # First successful response wins; a failed racer just leaves the other running
+        while pending and result is None:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if result is None and future.result():
+                    result = future.result()
+                    winner = future_models[future]
+        
+        for racer_model, handle in handles.items():
+            if racer_model != winner:
+                handle.cancel()
+        
+        if winner:
+            with self.hedge_lock:
+                self.hedge_stats["primary_wins" if winner == model else "fallback_wins"] += 1
+            result["hedge"] = {"primary": model, "fallback": fallback, "winner": winner}
+            print(f"🏁 Hedged request won by {winner}")
+        return result
+    
+    def report_prefix_cache(self):
+        """Print the provider-reported prefix-cache hit rate, when the provider exposes it"""
+        stats = self.backend.metrics.prefix_cache_stats()
+        if stats["calls"]:
+            print(f"🧊 Prefix cache: {stats['hit_rate']:.0%} of prompt tokens cached "
+                  f"({stats['calls_with_hits']}/{stats['calls']} calls with hits)")
+    
+    @staticmethod
+    def normalize_prompt_text(text: str) -> str:
+        """Canonical text: unified newlines, no trailing spaces, at most one blank line in a row"""
+        lines = [line.rstrip() for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+        return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+    
+    def request_fingerprint(self, messages: List[Dict], model: str, options: Optional[Dict] = None) -> str:
+        """Cache and coalescing key covering every message, the model, sampling options and template version"""
+        canonical = {
+            "template": PROMPT_TEMPLATE_VERSION,
+            "model": model,
+            "options": dict(self.backend.DEFAULT_OPTIONS, **(options or {})),
+            # prefix_len only marks a cache breakpoint for the provider, it never changes the answer
+            "messages": [[msg["role"], self.normalize_prompt_text(msg["content"])] for msg in messages]
+        }
+        payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False)
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=20).hexdigest()
+    
+    def parallel_ai_calls(self, requests_list: List[Tuple[List[Dict], str]], max_retries: int = 3,
+                          on_result: Optional[Callable] = None) -> List[Optional[Dict]]:
+        """Fan out many cached AI calls concurrently and gather the results in order"""
+        return self.async_client.run_many(requests_list, max_retries, on_result)
+    
+    def layout_prompt(self, system: str, stable_blocks: List[str], task: str) -> List[Dict]:
+        """Stable prefix first (system, project context, file content), volatile task last, for prefix caching"""
+        prefix = "".join(f"{block}\n\n" for block in stable_blocks if block)
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prefix + task, "prefix_len": len(prefix)}
+        ]
+    
+    def report_token_usage(self, messages: List[Dict], response: Optional[Dict]):
+        """Print input/output token counts for a completed call"""
+        if not response:
+            return
+        usage = response.get("usage") or {}
+        input_tokens = usage.get("prompt_tokens") or TokenBudget.count_messages(messages)
+        output_tokens = usage.get("completion_tokens")
+        if output_tokens is None and response.get("choices"):
+            output_tokens = TokenBudget.count(response["choices"][0]["message"]["content"])
+        cached = usage.get("cached_tokens") or self.backend.cached_tokens(usage)
+        cached_note = f" ({cached} from prefix cache)" if cached else ""
+        print(f"🔢 Tokens: {input_tokens} in{cached_note} / {output_tokens or 0} out")
+    
+    def cached_ai_call(self, messages: List[Dict], model: str, max_retries: int = 3,
+                       stream: bool = False, trim: bool = True, refresh: bool = False, **options) -> Optional[Dict]:
+        """AI call with intelligent caching (stream=True prints the answer as it arrives, refresh=True skips the lookup)"""
+        cache_key = self.request_fingerprint(messages, model, options)
+        feature = self.current_feature
+        # Check cache first
+        cached_response = None if refresh else self.cache_manager.get_cached_response(cache_key, feature)
+        if cached_response:
+            print("⚡ Cache hit! Returning cached response...")
+            if stream and cached_response.get("choices"):
+                print(cached_response["choices"][0]["message"]["content"])
+            return cached_response
+        
+        def call():
+            # Re-check: an identical request may have finished since the first lookup
+            cached_response = None if refresh else self.cache_manager.get_cached_response(cache_key, feature,
+                                                                                          record=False)
+            if cached_response:
+                if stream and cached_response.get("choices"):
+                    print(cached_response["choices"][0]["message"]["content"])
+                return cached_response
+            started = time.perf_counter()
+            
+            # Fit the prompt to the model's context window instead of letting the provider truncate it
+            request_messages = self.token_budget.fit(messages, model) if trim else messages
+            
+            # Make actual API call
+            if stream and self.config["streaming_enabled"]:
+                response = self.render_streamed_call(request_messages, model, max_retries, **options)
+            else:
+                response = self.robust_ai_call(request_messages, model, max_retries, **options)
+                if stream and response and response.get("choices"):
+                    print(response["choices"][0]["message"]["content"])
+                self.report_token_usage(request_messages, response)
+            
+            # Cache the response if successful
+            if response:
+                self.cache_manager.cache_response(cache_key, response, model, feature, time.perf_counter() - started)
+            return response
+        
+        # Identical concurrent requests share one network call
+        response, shared = self.single_flight.do(cache_key, call)
+        if shared:
+            print("🔗 Joined an identical in-flight request")
+            if stream and response and response.get("choices"):
+                print(response["choices"][0]["message"]["content"])
         
         return response
     
-    def read_project_files_smart(self) -> str:
+    def ai_edit_content(self, content: str, edit_prompt: str, full_file_messages: List[Dict],
+                        model: str) -> Optional[str]:
+        """Ask for search/replace hunks and apply them locally, falling back to a full-file rewrite"""
+        if self.config["patch_edits_enabled"]:
+            # Static format instructions live in the system prompt so every edit shares that prefix
+            patch_messages = [
+                {"role": "system", "content": "You are a senior developer editing existing code. You reply with minimal SEARCH/REPLACE edit blocks only.\n\n" + PatchEngine.FORMAT_INSTRUCTIONS},
+                {"role": "user", "content": edit_prompt}
+            ]
+            response = self.cached_ai_call(patch_messages, model)
+            if response and response.get("choices"):
+                edits = self.patch_engine.parse_edits(response["choices"][0]["message"]["content"])
+                if edits:
+                    new_content, failed = self.patch_engine.apply_edits(content, edits)
+                    if not failed:
+                        print(f"🩹 Applied {len(edits)} edit hunk(s)")
+                        return new_content
+                    print(f"⚠️  {len(failed)} of {len(edits)} hunk(s) did not apply, falling back to full-file output...")
+                else:
+                    print("⚠️  No edit hunks in response, falling back to full-file output...")
+        
+        # A rewrite must see the whole file and echo it back, so never trim it; refuse if it can't fit
+        needed = TokenBudget.count_messages(full_file_messages) + TokenBudget.count(content)
+        if needed > self.token_budget.window(model):
+            print(f"❌ Full-file rewrite needs ~{needed} tokens, more than {model}'s "
+                  f"{self.token_budget.window(model)} token window")
+            return None
+        response = self.cached_ai_call(full_file_messages, model, trim=False)
+        if response and response.get("choices"):
+            return self.extract_code_from_response(response["choices"][0]["message"]["content"])
+        return None
+    
+    def route_model(self, task_type: str, messages: List[Dict], default_model: str) -> str:
+        """Pick a model for the request, or keep the feature's default when routing is off"""
+        if not self.config["model_routing_enabled"]:
+            return default_model
+        model = self.router.route(task_type, ModelRouter.estimate_tokens(messages))
+        print(f"🧭 Routed {task_type} request to {model}")
+        return model
+    
+    def routed_ai_call(self, task_type: str, messages: List[Dict], default_model: str,
+                       stream: bool = False, refresh: bool = False) -> Optional[Dict]:
+        """Cached AI call on the routed model"""
+        return self.cached_ai_call(messages, self.route_model(task_type, messages, default_model),
+                                   stream=stream, refresh=refresh)
+    
+    def semantic_ai_call(self, question: str, messages: List[Dict], call: Callable[[bool], Optional[Dict]],
+                         stream: bool = False) -> Optional[Dict]:
+        """Offer an earlier answer to a reworded question before paying for call(refresh)"""
+        if self.semantic_cache is None:
+            return call(False)
+        
+        # Only questions asked against the same system prompt and project context are comparable
+        task = messages[-1]
+        stable = [[msg["role"], self.normalize_prompt_text(msg["content"])] for msg in messages[:-1]]
+        stable.append(self.normalize_prompt_text(task["content"][:task.get("prefix_len", 0)]))
+        context_key = hashlib.blake2b(json.dumps(stable).encode("utf-8"), digest_size=16).hexdigest()
+        feature = self.current_feature or "other"
+        
+        match, score = self.semantic_cache.lookup(feature, context_key, question)
+        if match:
+            self.semantic_cache.stats["offered"] += 1
+            print(f"♻️  Similar question answered before ({score:.0%} match): \"{match['question']}\"")
+            if stream:
+                print(match["response"]["choices"][0]["message"]["content"])
+            choice = input("🔄 Press Enter to use this answer, or type 'refresh' for a new one: ").strip().lower()
+            if choice != "refresh":
+                self.semantic_cache.stats["accepted"] += 1
+                return match["response"]
+            self.semantic_cache.stats["refreshed"] += 1
+        
+        response = call(match is not None)
+        if response and response.get("choices"):
+            self.semantic_cache.store(feature, context_key, question, response, replaces=match)
+        return response
+    
+    def routed_code_call(self, task_type: str, messages: List[Dict], default_model: str,
+                         run: Callable[[str], Optional[str]], filename: str = "",
+                         original: Optional[str] = None) -> Optional[str]:
+        """Produce code on the routed model, escalating to a larger one while the result does not parse"""
+        model = self.route_model(task_type, messages, default_model)
+        # An edit can only be blamed for breaking code that parsed before it
+        validate = self.config["model_routing_enabled"] and (
+            original is None or self.is_code_parseable(original, filename)
+        )
+        while True:
+            code = run(model)
+            if code is None or not validate or self.is_code_parseable(code, filename):
+                return code
+            bigger = self.router.escalate(model, task_type, ModelRouter.estimate_tokens(messages))
+            if not bigger:
+                print("⚠️  Result does not parse and no larger model is available")
+                return code
+            print(f"⬆️  Result from {model} does not parse, escalating to {bigger}...")
+            model = bigger
+    
+    def is_code_parseable(self, code: str, filename: str = "") -> bool:
+        """Cheap syntax check: ast for Python, json for JSON, balanced brackets for the rest"""
+        if "```" in code or "<<<<<<< SEARCH" in code or ">>>>>>> REPLACE" in code:
+            return False
+        if filename.endswith(".py"):
+            try:
+                ast.parse(code)
+                return True
+            except SyntaxError:
+                return False
+        if filename.endswith(".json"):
+            try:
+                json.loads(code)
+                return True
+            except ValueError:
+                return False
+        return self.brackets_balanced(code)
+    
+    def brackets_balanced(self, code: str) -> bool:
+        """Bracket balance check that skips strings and comments (JS/JSX/TS/CSS)"""
+        pairs = {")": "(", "]": "[", "}": "{"}
+        stack = []
+        i, n = 0, len(code)
+        while i < n:
+            ch = code[i]
+            if ch in "\"'`":
+                # Skip string literals; plain quotes stop at a newline (JSX text apostrophes)
+                i += 1
+                while i < n and code[i] != ch and (ch == "`" or code[i] != "\n"):
+                    i += 2 if code[i] == "\\" else 1
+            elif code.startswith("//", i) and (i == 0 or code[i - 1] != ":"):
+                while i < n and code[i] != "\n":
+                    i += 1
+            elif code.startswith("/*", i):
+                end = code.find("*/", i + 2)
+                i = n if end == -1 else end + 1
+            elif ch in "([{":
+                stack.append(ch)
+            elif ch in pairs:
+                if not stack or stack.pop() != pairs[ch]:
+                    return False
+            i += 1
+        return not stack
+    
+    def read_project_files_smart(self, verbose: bool = True, use_prefetch: bool = True) -> str:
         """Read essential project files"""
+        if use_prefetch and self.config["prefetch_enabled"]:
+            context = self.prefetcher.get("project_context")
+            print(f"⚡ Project context ready ({context.count(chr(10) + '=== ')} files)")
+            return context
+        
         context = ""
         file_count = 0
         essential_files = [
@@ -548,12 +1922,14 @@ class AIAssistant:
                         if len(content) < 10000:
                             context += f"\n=== {file} ===\n{content}\n"
                             file_count += 1
-                            print(f"📄 Added: {file}")
+                            if verbose:
+                                print(f"📄 Added: {file}")
                 except: pass
         
         component_examples = []
         for root, dirs, files in os.walk("src/components"):
-            for file in files:
+            dirs.sort()  # Stable order keeps the context byte-identical between calls (prefix caching)
+            for file in sorted(files):
                 if file.endswith((".jsx", ".js", ".css")):
                     component_examples.append(os.path.join(root, file))
                     if len(component_examples) >= 5: break
@@ -566,10 +1942,12 @@ class AIAssistant:
                     if len(content) < 5000:
                         context += f"\n=== {file_path} ===\n{content}\n"
                         file_count += 1
-                        print(f"📄 Added example: {file_path}")
+                        if verbose:
+                            print(f"📄 Added example: {file_path}")
             except: pass
         
-        print(f"\n📊 Total files read: {file_count}")
+        if verbose:
+            print(f"\n📊 Total files read: {file_count}")
         return context
     
     def show_file_diff(self, old_content: str, new_content: str, filename: str):
@@ -622,20 +2000,25 @@ class AIAssistant:
         question = input("🤔 What's your question about the code? ")
         context = self.read_project_files_smart()
         
-        messages = [
-            {"role": "system", "content": "You are a senior React developer analyzing a codebase."},
-            {"role": "user", "content": f"Project files:\n{context}\n\nQuestion: {question}"}
-        ]
+        messages = self.layout_prompt(
+            "You are a senior React developer analyzing a codebase.",
+            [f"Project files:\n{context}"],
+            f"Question: {question}"
+        )
         
         self.add_to_history("user", f"Analysis request: {question}")
         
-        response = self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro")
+        print("\n💡 Analysis Result:")
+        print("=" * 50)
+        response = self.semantic_ai_call(
+            question, messages,
+            lambda refresh: self.routed_ai_call("analysis", messages, "meta-llama/llama-3-70b-instruct:nitro",
+                                                stream=True, refresh=refresh),
+            stream=True
+        )
         
         if response and response.get("choices"):
             answer = response["choices"][0]["message"]["content"]
-            print("\n💡 Analysis Result:")
-            print("=" * 50)
-            print(answer)
             self.add_to_history("assistant", answer)
             
             save = input("\n💾 Save analysis to file? (y/n): ")
@@ -648,19 +2031,23 @@ class AIAssistant:
         task = input("🎯 What code do you want to generate? ")
         context = self.read_context_intelligently("generate_component")
         
-        messages = [
-            {"role": "system", "content": "You are a React developer. Generate clean, modern code that follows the project patterns."},
-            {"role": "user", "content": f"Project context:\n{context}\n\nTask: {task}\nProvide only the code without explanations."}
-        ]
+        messages = self.layout_prompt(
+            "You are a React developer. Generate clean, modern code that follows the project patterns.",
+            [f"Project context:\n{context}"],
+            f"Task: {task}\nProvide only the code without explanations."
+        )
         
         self.add_to_history("user", f"Generation request: {task}")
         
-        response = self.cached_ai_call(messages, "mistralai/mistral-7b-instruct:nitro")
+        def generate(model):
+            response = self.cached_ai_call(messages, model)
+            if response and response.get("choices"):
+                return self.extract_code_from_response(response["choices"][0]["message"]["content"])
+            return None
         
-        if response and response.get("choices"):
-            response_text = response["choices"][0]["message"]["content"]
-            code = self.extract_code_from_response(response_text)
-            
+        code = self.routed_code_call("generate", messages, "mistralai/mistral-7b-instruct:nitro", generate)
+        
+        if code is not None:
             print("\n🚀 Generated Code:")
             print("=" * 50)
             print(code)
@@ -702,19 +2089,26 @@ class AIAssistant:
             
             task = input("\n🔧 What modification do you want? ")
             
-            messages = [
-                {"role": "system", "content": "You are a senior developer modifying existing code. Provide only the complete modified code exactly as it should appear in the file. DO NOT include markdown code blocks, explanations, or any other text."},
-                {"role": "user", "content": f"File: {actual_filename}\nCurrent complete content:\n{current_content}\n\nTask: {task}\n\nIMPORTANT: Return ONLY the complete file content as it should appear after changes. Do not wrap in markdown or add any explanations."}
-            ]
+            messages = self.layout_prompt(
+                "You are a senior developer modifying existing code. Provide only the complete modified code exactly as it should appear in the file. DO NOT include markdown code blocks, explanations, or any other text.",
+                [f"File: {actual_filename}\nCurrent complete content:\n{current_content}"],
+                f"Task: {task}\n\nIMPORTANT: Return ONLY the complete file content as it should appear after changes. Do not wrap in markdown or add any explanations."
+            )
             
             print("🤖 Asking AI to modify the file...")
-            response = self.cached_ai_call(messages, "mistralai/mistral-7b-instruct:nitro")
+            modified_code = self.routed_code_call(
+                "edit", messages, "mistralai/mistral-7b-instruct:nitro",
+                lambda model: self.ai_edit_content(
+                    current_content,
+                    f"File: {actual_filename}\nCurrent complete content:\n{current_content}\n\nTask: {task}",
+                    messages,
+                    model
+                ),
+                actual_filename,
+                original=current_content
+            )
             
-            if response and response.get("choices"):
-                modified_code = response["choices"][0]["message"]["content"]
-                # Extract clean code (remove any markdown or extra text)
-                modified_code = self.extract_code_from_response(modified_code)
-                
+            if modified_code is not None:
                 # Validate that we got meaningful content
                 if not modified_code or len(modified_code.strip()) < 10:
                     print("❌ AI returned empty or invalid content. Operation cancelled.")
@@ -750,12 +2144,13 @@ class AIAssistant:
         print("📊 Analyzing project structure...")
         context = self.read_project_files_smart()
         
-        messages = [
-            {"role": "system", "content": "You are a technical architect analyzing a React project. Provide a comprehensive overview."},
-            {"role": "user", "content": f"Analyze this React project:\n{context}\n\nProvide: 1) Project overview 2) Key features 3) Architecture 4) Recommendations"}
-        ]
+        messages = self.layout_prompt(
+            "You are a technical architect analyzing a React project. Provide a comprehensive overview.",
+            [f"Project files:\n{context}"],
+            "Analyze this React project. Provide: 1) Project overview 2) Key features 3) Architecture 4) Recommendations"
+        )
         
-        response = self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro")
+        response = self.routed_ai_call("analysis", messages, "meta-llama/llama-3-70b-instruct:nitro")
         
         if response and response.get("choices"):
             analysis = response["choices"][0]["message"]["content"]
@@ -796,16 +2191,24 @@ class AIAssistant:
                 with open(filename, 'r', encoding='utf-8') as f:
                     content = f.read()
                 
-                messages = [
-                    {"role": "system", "content": "You are a developer. Modify this file according to the task."},
-                    {"role": "user", "content": f"File: {filename}\nContent:\n{content}\n\nTask: {task}\n\nReturn only the modified file content."}
-                ]
+                messages = self.layout_prompt(
+                    "You are a developer. Modify this file according to the task.",
+                    [f"File: {filename}\nContent:\n{content}"],
+                    f"Task: {task}\n\nReturn only the modified file content."
+                )
                 
-                response = self.cached_ai_call(messages, "mistralai/mistral-7b-instruct:nitro")
-                if response and response.get("choices"):
-                    modified_content = response["choices"][0]["message"]["content"]
-                    modified_content = self.extract_code_from_response(modified_content)
-                    
+                modified_content = self.routed_code_call(
+                    "edit", messages, "mistralai/mistral-7b-instruct:nitro",
+                    lambda model: self.ai_edit_content(
+                        content,
+                        f"File: {filename}\nContent:\n{content}\n\nTask: {task}",
+                        messages,
+                        model
+                    ),
+                    filename,
+                    original=content
+                )
+                if modified_content is not None:
                     if modified_content and len(modified_content.strip()) > 10:
                         self.backup_file(filename)
                         self.write_to_file(filename, modified_content)
@@ -828,12 +2231,13 @@ class AIAssistant:
         with open(actual_filename, 'r') as f:
             content = f.read()
         
-        messages = [
-            {"role": "system", "content": "You are a senior developer performing code review. Analyze for: 1) Best practices 2) Performance 3) Security 4) Maintainability 5) Accessibility"},
-            {"role": "user", "content": f"Code to review:\n{content}\n\nProvide specific suggestions with line numbers."}
-        ]
+        messages = self.layout_prompt(
+            "You are a senior developer performing code review. Analyze for: 1) Best practices 2) Performance 3) Security 4) Maintainability 5) Accessibility",
+            [f"Code to review:\n{content}"],
+            "Provide specific suggestions with line numbers."
+        )
         
-        response = self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro")
+        response = self.routed_ai_call("analysis", messages, "meta-llama/llama-3-70b-instruct:nitro")
         if response:
             analysis = response["choices"][0]["message"]["content"]
             print("\n🔍 Code Quality Analysis:")
@@ -872,6 +2276,23 @@ class AIAssistant:
         
         tree(".")
 
+    def benchmark_model_call(self, messages: List[Dict], model_id: str) -> Dict:
+        """Run one uncached call quietly and return its answer with timing metrics"""
+        metrics = {}
+        answer = ""
+        try:
+            if self.config["streaming_enabled"]:
+                answer = "".join(self.stream_ai_call(messages, model_id, max_retries=1, metrics=metrics))
+            else:
+                response = self.robust_ai_call(messages, model_id, max_retries=1, metrics=metrics, hedge=False)
+                if response and response.get("choices"):
+                    answer = response["choices"][0]["message"]["content"]
+        except Exception as e:
+            print(f"❌ {model_id} error: {e}")
+        
+        # Metrics are only recorded for calls that completed cleanly
+        return {"answer": answer if answer and metrics else None, "metrics": metrics}
+
     def compare_models_response(self):
         """Compare responses from multiple AI models"""
         print("🤖 Multi-Model Comparison")
@@ -886,52 +2307,84 @@ class AIAssistant:
             ("Claude 3 Haiku", "anthropic/claude-3-haiku:nitro")
         ]
         
-        print(f"\n🔍 Comparing {len(models)} models...")
+        print(f"\n🔍 Comparing {len(models)} models concurrently...")
         print("=" * 50)
         
-        results = {}
+        messages = [
+            {"role": "system", "content": "Provide a clear, concise, and helpful response."},
+            {"role": "user", "content": prompt}
+        ]
         
-        for i, (model_name, model_id) in enumerate(models, 1):
-            print(f"\n🔄 Getting response from {model_name}...")
-            
-            messages = [
-                {"role": "system", "content": "Provide a clear, concise, and helpful response."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = self.cached_ai_call(messages, model_id, max_retries=1)  # Single retry for comparison
+        results = {}
+        benchmarks = {}
+        wall_start = time.perf_counter()
+        
+        # Bypass the cache so every model is measured live
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(models)) as executor:
+            future_to_model = {
+                executor.submit(self.benchmark_model_call, messages, model_id): model_name
+                for model_name, model_id in models
+            }
             
-            if response and response.get("choices"):
-                answer = response["choices"][0]["message"]["content"]
-                results[model_name] = answer
-                
-                print(f"\n📝 {model_name} Response:")
-                print("-" * 30)
-                # Show first 300 characters for preview
-                preview = answer[:300] + "..." if len(answer) > 300 else answer
-                print(preview)
+            for future in concurrent.futures.as_completed(future_to_model):
+                model_name = future_to_model[future]
+                outcome = future.result()
+                answer = outcome["answer"]
                 
-                # Show response length
-                print(f"   (Response length: {len(answer)} characters)")
-            else:
-                print(f"❌ {model_name} failed to respond")
-                results[model_name] = "Failed to get response"
+                if answer:
+                    results[model_name] = answer
+                    benchmarks[model_name] = outcome["metrics"]
+                    
+                    print(f"\n📝 {model_name} Response:")
+                    print("-" * 30)
+                    # Show first 300 characters for preview
+                    preview = answer[:300] + "..." if len(answer) > 300 else answer
+                    print(preview)
+                    
+                    # Show response length and timing
+                    print(f"   (Response length: {len(answer)} characters, {outcome['metrics']['latency']:.2f}s)")
+                else:
+                    print(f"\n❌ {model_name} failed to respond")
+                    results[model_name] = "Failed to get response"
         
-        # Summary comparison
+        wall_time = time.perf_counter() - wall_start
+        
+        # Summary comparison (in the original model order)
         print(f"\n📊 Summary:")
         print("=" * 30)
-        for model_name, response in results.items():
+        for model_name, _ in models:
+            response = results.get(model_name, "Failed to get response")
             if response != "Failed to get response":
                 word_count = len(response.split())
-                print(f"{model_name}: {word_count} words")
+                stats = benchmarks[model_name]
+                print(f"{model_name}: {word_count} words | latency {stats['latency']:.2f}s | "
+                      f"TTFT {stats['ttft']:.2f}s | {stats['output_tokens']} tokens | "
+                      f"{stats['tokens_per_sec']} tok/s")
             else:
                 print(f"{model_name}: Failed")
         
+        sequential_time = sum(stats["latency"] for stats in benchmarks.values())
+        print(f"\n⏱️  Wall time: {wall_time:.2f}s (sequential would be ~{sequential_time:.2f}s)")
+        
         # Option to save comparison
         save_comparison = input("\n💾 Save detailed comparison? (y/n): ")
         if save_comparison.lower() == 'y':
             comparison_content = f"# AI Model Comparison\n\nPrompt: {prompt}\n\n"
-            for model_name, response in results.items():
+            comparison_content += "## Benchmark\n\n"
+            comparison_content += "| Model | Latency (s) | TTFT (s) | Output tokens | Tokens/sec | Words |\n"
+            comparison_content += "|-------|-------------|----------|---------------|------------|-------|\n"
+            for model_name, _ in models:
+                if model_name in benchmarks:
+                    stats = benchmarks[model_name]
+                    comparison_content += (f"| {model_name} | {stats['latency']:.2f} | {stats['ttft']:.2f} | "
+                                           f"{stats['output_tokens']} | {stats['tokens_per_sec']} | "
+                                           f"{len(results[model_name].split())} |\n")
+                else:
+                    comparison_content += f"| {model_name} | failed | - | - | - | - |\n"
+            comparison_content += f"\nWall time: {wall_time:.2f}s\n"
+            
+            for model_name, _ in models:
+                response = results.get(model_name, "Failed to get response")
                 comparison_content += f"\n## {model_name}\n\n{response}\n\n"
                 comparison_content += f"---\n"
             
@@ -1013,13 +2466,12 @@ class AIAssistant:
         ]
         
         print("🤖 Analyzing the issue...")
-        response = self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro")
+        print("\n🔧 Debugging Solution:")
+        print("=" * 50)
+        response = self.routed_ai_call("debug", messages, "meta-llama/llama-3-70b-instruct:nitro", stream=True)
         
         if response and response.get("choices"):
             debug_solution = response["choices"][0]["message"]["content"]
-            print("\n🔧 Debugging Solution:")
-            print("=" * 50)
-            print(debug_solution)
             
             save_debug = input("\n💾 Save debugging solution? (y/n): ")
             if save_debug.lower() == 'y':
@@ -1248,139 +2700,136 @@ class AIAssistant:
         
         generated_tests = []
         
-        for test_type in test_types:
-            print(f"\n🤖 Generating {test_type.title()} Tests...")
-            
-            if test_type == "unit":
-                prompt = f"""
-                Generate comprehensive unit tests for this React component using React Testing Library:
+        with self.operation_deadline("comprehensive_testing") as deadline:
+            for test_type in test_types:
+                if deadline.expired:
+                    print(f"⌛ Time budget used up, skipping {test_type} tests")
+                    continue
+                print(f"\n🤖 Generating {test_type.title()} Tests...")
                 
-                Component: {actual_filename}
-                Code: {component_content}
+                if test_type == "unit":
+                    prompt = """
+                    Generate comprehensive unit tests for this React component using React Testing Library:
+                    
+                    Include tests for:
+                    1. Rendering with default props
+                    2. Rendering with different prop values
+                    3. User interactions and event handling
+                    4. State changes
+                    5. Edge cases
+                    6. Error conditions
+                    7. Accessibility (aria labels, roles)
+                    
+                    Use best practices:
+                    - Test behavior, not implementation
+                    - Use descriptive test names
+                    - Mock external dependencies
+                    - Test async operations properly
+                    """
+                    
+                elif test_type == "integration":
+                    prompt = """
+                    Generate integration tests for this React component:
+                    
+                    Test the component's interaction with:
+                    1. Redux/Context state management
+                    2. API calls and data fetching
+                    3. Router navigation
+                    4. Child components
+                    5. External libraries
+                    6. Browser APIs
+                    
+                    Include:
+                    - Setup and teardown
+                    - Mock implementations
+                    - Test data fixtures
+                    - Async operation testing
+                    """
+                    
+                else:  # e2e
+                    prompt = """
+                    Generate end-to-end test scenarios for this React component:
+                    
+                    Create test scenarios for:
+                    1. User workflows and journeys
+                    2. Form submissions and validations
+                    3. Navigation and routing
+                    4. Data persistence
+                    5. Error handling
+                    6. Performance scenarios
+                    
+                    Provide:
+                    - Test case descriptions
+                    - Setup instructions
+                    - Expected outcomes
+                    - Edge case scenarios
+                    - Performance considerations
+                    """
                 
-                Include tests for:
-                1. Rendering with default props
-                2. Rendering with different prop values
-                3. User interactions and event handling
-                4. State changes
-                5. Edge cases
-                6. Error conditions
-                7. Accessibility (aria labels, roles)
+                messages = self.layout_prompt(
+                    "You are a testing expert. Generate complete, runnable test files with proper imports and best practices.",
+                    [f"Component: {actual_filename}\nCode:\n{component_content}"],
+                    prompt
+                )
                 
-                Use best practices:
-                - Test behavior, not implementation
-                - Use descriptive test names
-                - Mock external dependencies
-                - Test async operations properly
-                """
+                response = self.cached_ai_call(messages, "mistralai/mistral-7b-instruct:nitro")
                 
-            elif test_type == "integration":
-                prompt = f"""
-                Generate integration tests for this React component:
+                if response and response.get("choices"):
+                    test_content = response["choices"][0]["message"]["content"]
+                    test_content = self.extract_code_from_response(test_content)
+                    
+                    if test_content and len(test_content.strip()) > 20:
+                        # Generate appropriate filename
+                        base_name = os.path.splitext(actual_filename)[0]
+                        if test_type == "unit":
+                            test_filename = f"{base_name}.test.jsx"
+                        elif test_type == "integration":
+                            test_filename = f"{base_name}.integration.test.jsx"
+                        else:
+                            test_filename = f"{base_name}.e2e.test.jsx"
+                        
+                        # Write the test file
+                        success = self.write_to_file(test_filename, test_content)
+                        if success:
+                            generated_tests.append(test_filename)
+                            print(f"✅ {test_type.title()} tests generated: {test_filename}")
+                        else:
+                            print(f"❌ Failed to generate {test_type} tests")
+                    else:
+                        print(f"❌ No valid {test_type} test content generated")
+                else:
+                    print(f"❌ Failed to get {test_type} test response from AI")
+            
+            # Generate test documentation
+            if generated_tests and not deadline.expired:
+                doc_prompt = f"""
+                Create test documentation for these generated tests:
                 
                 Component: {actual_filename}
-                Code: {component_content}
+                Generated Tests: {', '.join(generated_tests)}
                 
-                Test the component's interaction with:
-                1. Redux/Context state management
-                2. API calls and data fetching
-                3. Router navigation
-                4. Child components
-                5. External libraries
-                6. Browser APIs
-                
-                Include:
-                - Setup and teardown
-                - Mock implementations
-                - Test data fixtures
-                - Async operation testing
+                Provide:
+                1. Test strategy overview
+                2. How to run each test type
+                3. Test coverage summary
+                4. Best practices for maintaining tests
+                5. Troubleshooting common issues
                 """
                 
-            else:  # e2e
-                prompt = f"""
-                Generate end-to-end test scenarios for this React component:
-                
-                Component: {actual_filename}
-                Code: {component_content}
-                
-                Create test scenarios for:
-                1. User workflows and journeys
-                2. Form submissions and validations
-                3. Navigation and routing
-                4. Data persistence
-                5. Error handling
-                6. Performance scenarios
+                messages = [
+                    {"role": "system", "content": "You are a technical writer. Create comprehensive test documentation."},
+                    {"role": "user", "content": doc_prompt}
+                ]
                 
-                Provide:
-                - Test case descriptions
-                - Setup instructions
-                - Expected outcomes
-                - Edge case scenarios
-                - Performance considerations
-                """
-            
-            messages = [
-                {"role": "system", "content": "You are a testing expert. Generate complete, runnable test files with proper imports and best practices."},
-                {"role": "user", "content": prompt}
-            ]
-            
-            response = self.cached_ai_call(messages, "mistralai/mistral-7b-instruct:nitro")
-            
-            if response and response.get("choices"):
-                test_content = response["choices"][0]["message"]["content"]
-                test_content = self.extract_code_from_response(test_content)
+                response = self.cached_ai_call(messages, "mistralai/mistral-7b-instruct:nitro")
                 
-                if test_content and len(test_content.strip()) > 20:
-                    # Generate appropriate filename
-                    base_name = os.path.splitext(actual_filename)[0]
-                    if test_type == "unit":
-                        test_filename = f"{base_name}.test.jsx"
-                    elif test_type == "integration":
-                        test_filename = f"{base_name}.integration.test.jsx"
-                    else:
-                        test_filename = f"{base_name}.e2e.test.jsx"
-                    
-                    # Write the test file
-                    success = self.write_to_file(test_filename, test_content)
-                    if success:
-                        generated_tests.append(test_filename)
-                        print(f"✅ {test_type.title()} tests generated: {test_filename}")
-                    else:
-                        print(f"❌ Failed to generate {test_type} tests")
-                else:
-                    print(f"❌ No valid {test_type} test content generated")
-            else:
-                print(f"❌ Failed to get {test_type} test response from AI")
+                if response and response.get("choices"):
+                    doc_content = response["choices"][0]["message"]["content"]
+                    doc_filename = f"{os.path.splitext(actual_filename)[0]}.TESTING.md"
+                    self.write_to_file(doc_filename, f"# Testing Documentation\n\n{doc_content}")
+                    print(f"✅ Test documentation generated: {doc_filename}")
         
-        # Generate test documentation
         if generated_tests:
-            doc_prompt = f"""
-            Create test documentation for these generated tests:
-            
-            Component: {actual_filename}
-            Generated Tests: {', '.join(generated_tests)}
-            
-            Provide:
-            1. Test strategy overview
-            2. How to run each test type
-            3. Test coverage summary
-            4. Best practices for maintaining tests
-            5. Troubleshooting common issues
-            """
-            
-            messages = [
-                {"role": "system", "content": "You are a technical writer. Create comprehensive test documentation."},
-                {"role": "user", "content": doc_prompt}
-            ]
-            
-            response = self.cached_ai_call(messages, "mistralai/mistral-7b-instruct:nitro")
-            
-            if response and response.get("choices"):
-                doc_content = response["choices"][0]["message"]["content"]
-                doc_filename = f"{os.path.splitext(actual_filename)[0]}.TESTING.md"
-                self.write_to_file(doc_filename, f"# Testing Documentation\n\n{doc_content}")
-                print(f"✅ Test documentation generated: {doc_filename}")
-            
             print(f"\n🎉 Successfully generated {len(generated_tests)} test files!")
             print("Generated files:")
             for test_file in generated_tests:
@@ -1889,72 +3338,90 @@ class AIAssistant:
         """Perform actual code migration"""
         print(f"\n🔧 Performing {migration_type} migration...")
         
-        if scope.lower() == 'all':
-            # Get all relevant files
-            files_to_migrate = []
-            for root, dirs, files in os.walk("src"):
-                for file in files:
-                    if file.endswith(('.js', '.jsx', '.ts', '.tsx', '.css')):
-                        files_to_migrate.append(os.path.join(root, file))
-        else:
-            # Get specific files
-            files_to_migrate = []
-            file_names = scope.split(',')
-            for file_name in file_names:
-                file_name = file_name.strip()
-                actual_file = self.smart_file_finder(file_name)
-                if actual_file and os.path.exists(actual_file):
-                    files_to_migrate.append(actual_file)
-        
-        print(f"📁 Found {len(files_to_migrate)} files to migrate")
-        
-        for file_path in files_to_migrate:
-            print(f"\n📝 Processing {file_path}...")
+        files_to_migrate = []
+        processed = 0
+        with self.operation_deadline("perform_migration") as deadline:
+            if scope.lower() == 'all':
+                # Get all relevant files
+                files_to_migrate = []
+                for root, dirs, files in os.walk("src"):
+                    if deadline.expired:
+                        print("⌛ Time budget used up while scanning files")
+                        break
+                    for file in files:
+                        if file.endswith(('.js', '.jsx', '.ts', '.tsx', '.css')):
+                            files_to_migrate.append(os.path.join(root, file))
+            else:
+                # Get specific files
+                files_to_migrate = []
+                file_names = scope.split(',')
+                for file_name in file_names:
+                    file_name = file_name.strip()
+                    # The finder may ask which match to use; that wait is not migration time
+                    with deadline.paused():
+                        actual_file = self.smart_file_finder(file_name)
+                    if actual_file and os.path.exists(actual_file):
+                        files_to_migrate.append(actual_file)
             
-            try:
-                # Create backup
-                backup_file = self.backup_file(file_path)
-                
-                # Read current content
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    current_content = f.read()
-                
-                # Generate migration prompt based on type
-                migration_prompt = self.get_migration_prompt(migration_type, file_path, current_content)
-                
-                messages = [
-                    {"role": "system", "content": "You are a senior developer performing code migration. Return only the migrated code."},
-                    {"role": "user", "content": migration_prompt}
-                ]
-                
-                # Get migrated code
-                response = self.cached_ai_call(messages, "mistralai/mistral-7b-instruct:nitro")
+            print(f"📁 Found {len(files_to_migrate)} files to migrate")
+            
+            for file_path in files_to_migrate:
+                if deadline.expired:
+                    break
+                processed += 1
+                print(f"\n📝 Processing {file_path}...")
                 
-                if response and response.get("choices"):
-                    migrated_content = response["choices"][0]["message"]["content"]
-                    migrated_content = self.extract_code_from_response(migrated_content)
+                try:
+                    # Create backup
+                    backup_file = self.backup_file(file_path)
                     
-                    if migrated_content and len(migrated_content.strip()) > 10:
-                        # Show diff preview
-                        self.preview_changes(file_path, migrated_content)
-                        
-                        # Confirm migration
-                        confirm = input(f"\n✅ Apply migration to {file_path}? (y/n): ")
-                        if confirm.lower() == 'y':
-                            success = self.write_to_file(file_path, migrated_content)
-                            if success:
-                                print(f"✅ Successfully migrated {file_path}")
+                    # Read current content
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        current_content = f.read()
+                    
+                    # Generate migration prompt based on type
+                    migration_prompt = self.get_migration_prompt(migration_type, file_path, current_content)
+                    
+                    messages = [
+                        {"role": "system", "content": "You are a senior developer performing code migration. Return only the migrated code."},
+                        {"role": "user", "content": migration_prompt}
+                    ]
+                    
+                    # Get migrated code
+                    migrated_content = self.routed_code_call(
+                        "edit", messages, "mistralai/mistral-7b-instruct:nitro",
+                        lambda model: self.ai_edit_content(current_content, migration_prompt, messages, model),
+                        file_path,
+                        original=current_content
+                    )
+                    
+                    if migrated_content is not None:
+                        if migrated_content and len(migrated_content.strip()) > 10:
+                            # Show diff preview
+                            self.preview_changes(file_path, migrated_content)
+                            
+                            # Confirm migration
+                            with deadline.paused():
+                                confirm = input(f"\n✅ Apply migration to {file_path}? (y/n): ")
+                            if confirm.lower() == 'y':
+                                success = self.write_to_file(file_path, migrated_content)
+                                if success:
+                                    print(f"✅ Successfully migrated {file_path}")
+                                else:
+                                    print(f"❌ Failed to migrate {file_path}")
                             else:
-                                print(f"❌ Failed to migrate {file_path}")
+                                print(f"❌ Migration cancelled for {file_path}")
                         else:
-                            print(f"❌ Migration cancelled for {file_path}")
+                            print(f"❌ No valid migrated content for {file_path}")
                     else:
-                        print(f"❌ No valid migrated content for {file_path}")
-                else:
-                    print(f"❌ Failed to get migration response for {file_path}")
-                    
-            except Exception as e:
-                print(f"❌ Error migrating {file_path}: {e}")
+                        print(f"❌ Failed to get migration response for {file_path}")
+                        
+                except Exception as e:
+                    print(f"❌ Error migrating {file_path}: {e}")
+        
+        if deadline.expired:
+            skipped = len(files_to_migrate) - processed
+            print(f"\n⌛ Migration stopped early: {processed} file(s) processed, {skipped} not started")
 
     def get_migration_prompt(self, migration_type: str, file_path: str, content: str) -> str:
         """Generate specific migration prompt based on type"""
@@ -2307,13 +3774,16 @@ class AIAssistant:
             {"role": "user", "content": f"Task: {complex_task}\n\nPlease think through this step by step:"}
         ]
         
-        response = self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro")
-        if response:
-            reasoning = response["choices"][0]["message"]["content"]
-            print("🔍 Reasoning Process:")
-            print("=" * 30)
-            print(reasoning)
-            return reasoning
+        print("🔍 Reasoning Process:")
+        print("=" * 30)
+        response = self.semantic_ai_call(
+            complex_task, messages,
+            lambda refresh: self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro",
+                                                stream=True, refresh=refresh),
+            stream=True
+        )
+        if response and response.get("choices"):
+            return response["choices"][0]["message"]["content"]
 
     def enhanced_code_analysis(self):
         """Enhanced code analysis with static analysis engine"""
@@ -2425,22 +3895,31 @@ class AIAssistant:
         print("⚡ Parallel File Analysis")
         print("=" * 30)
         
-        # Find all source files
-        source_files = []
-        for root, dirs, files in os.walk("src"):
-            for file in files:
-                if file.endswith(('.js', '.jsx', '.ts', '.tsx')):
-                    source_files.append(os.path.join(root, file))
-        
-        if not source_files:
-            print("❌ No source files found!")
-            return
-        
-        print(f"Found {len(source_files)} files to analyze...")
-        
-        # Use parallel processing
-        processor = ParallelProcessor()
-        results = processor.process_files_parallel(source_files, self.analyze_single_file)
+        if self.config["prefetch_enabled"]:
+            # Warm metrics from the background worker; only changed files get re-analyzed
+            static_metrics = self.prefetcher.get("static_metrics")
+            if not static_metrics:
+                print("❌ No source files found!")
+                return
+            print(f"⚡ Using prefetched metrics for {len(static_metrics)} files...")
+            results = {file_path: entry["result"] for file_path, entry in static_metrics.items()}
+        else:
+            # Find all source files
+            source_files = []
+            for root, dirs, files in os.walk("src"):
+                for file in files:
+                    if file.endswith(('.js', '.jsx', '.ts', '.tsx')):
+                        source_files.append(os.path.join(root, file))
+            
+            if not source_files:
+                print("❌ No source files found!")
+                return
+            
+            print(f"Found {len(source_files)} files to analyze...")
+            
+            # Use parallel processing
+            processor = ParallelProcessor()
+            results = processor.process_files_parallel(source_files, self.analyze_single_file)
         
         # Aggregate results
         total_issues = 0
@@ -2463,6 +3942,26 @@ class AIAssistant:
         for file_path, issue_count in sorted_files[:5]:
             print(f"  {file_path}: {issue_count} issues")
 
+    def build_static_metrics(self) -> Dict:
+        """Per-file static metrics for src/, re-analyzing only files whose mtime changed"""
+        previous = self.prefetcher.values.get("static_metrics", (None, {}))[1]
+        metrics = {}
+        for root, dirs, files in os.walk("src"):
+            dirs.sort()
+            for file in sorted(files):
+                if file.endswith(('.js', '.jsx', '.ts', '.tsx')):
+                    file_path = os.path.join(root, file)
+                    try:
+                        mtime = os.path.getmtime(file_path)
+                    except OSError:
+                        continue
+                    cached = previous.get(file_path)
+                    if cached and cached["mtime"] == mtime:
+                        metrics[file_path] = cached
+                    else:
+                        metrics[file_path] = {"mtime": mtime, "result": self.analyze_single_file(file_path)}
+        return metrics
+    
     def analyze_single_file(self, file_path: str) -> Dict:
         """Analyze a single file (used by parallel processor)"""
         try:
@@ -2522,51 +4021,74 @@ class AIAssistant:
             print("❌ No files to review!")
             return
         
-        # Perform comprehensive review
+        # Multi-aspect review
+        review_aspects = [
+            "Code Quality and Best Practices",
+            "Performance Optimization",
+            "Security Considerations", 
+            "Accessibility Compliance",
+            "Maintainability and Readability",
+            "Error Handling and Edge Cases"
+        ]
+        
+        # Build every (file, aspect) request up front so they can run concurrently
         review_results = []
+        review_jobs = []
+        review_requests = []
         
         for file_path in files_to_review:
-            print(f"\n🔍 Reviewing {file_path}...")
-            
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
                     content = f.read()
-                
-                # Multi-aspect review
-                review_aspects = [
-                    "Code Quality and Best Practices",
-                    "Performance Optimization",
-                    "Security Considerations", 
-                    "Accessibility Compliance",
-                    "Maintainability and Readability",
-                    "Error Handling and Edge Cases"
-                ]
-                
-                file_reviews = {}
-                for aspect in review_aspects:
-                    messages = [
-                        {"role": "system", "content": f"You are a senior {aspect} expert. Provide detailed, actionable feedback."},
-                        {"role": "user", "content": f"""
-                        Review this code for {aspect.lower()}:
-                        
-                        File: {file_path}
-                        Code: {content}
-                        
-                        Provide specific feedback with line numbers and improvement suggestions.
-                        """}
-                    ]
-                    
-                    response = self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro")
-                    if response:
-                        file_reviews[aspect] = response["choices"][0]["message"]["content"]
-                
-                review_results.append({
-                    "file": file_path,
-                    "reviews": file_reviews
-                })
-                
             except Exception as e:
                 print(f"❌ Error reviewing {file_path}: {e}")
+                continue
+            
+            file_result = {"file": file_path, "reviews": {}}
+            review_results.append(file_result)
+            
+            # Every aspect shares the same system prompt and file prefix; only the final line differs
+            for aspect in review_aspects:
+                messages = self.layout_prompt(
+                    "You are a senior code reviewer and an expert in every review aspect. Provide detailed, actionable feedback.",
+                    [f"File: {file_path}\nCode:\n{content}"],
+                    f"Review this code for {aspect.lower()}. Provide specific feedback with line numbers and improvement suggestions."
+                )
+                review_jobs.append((file_result, aspect))
+                review_requests.append((messages, "meta-llama/llama-3-70b-instruct:nitro"))
+        
+        print(f"\n🔍 Reviewing {len(review_results)} files ({len(review_requests)} requests in parallel)...")
+        
+        completed = {}
+        
+        def report_progress(index, response):
+            file_result, aspect = review_jobs[index]
+            completed[index] = response
+            status = "✅" if response else "❌"
+            print(f"  {status} {file_result['file']} - {aspect}")
+        
+        # First aspect of each file goes out alone to warm the provider's prefix cache for the rest
+        first_aspect = [i for i, (_, aspect) in enumerate(review_jobs) if aspect == review_aspects[0]]
+        other_aspects = [i for i, (_, aspect) in enumerate(review_jobs) if aspect != review_aspects[0]]
+        
+        with self.operation_deadline("code_review_assistant") as deadline:
+            for batch in (first_aspect, other_aspects):
+                self.parallel_ai_calls(
+                    [review_requests[i] for i in batch],
+                    on_result=lambda position, response, batch=batch: report_progress(batch[position], response)
+                )
+        
+        # Keep aspects in their original order regardless of completion order
+        for index, (file_result, aspect) in enumerate(review_jobs):
+            response = completed.get(index)
+            if response and response.get("choices"):
+                file_result["reviews"][aspect] = response["choices"][0]["message"]["content"]
+        
+        if deadline.expired:
+            finished = sum(1 for response in completed.values() if response)
+            print(f"\n⌛ Review stopped early: {finished}/{len(review_requests)} reviews completed")
+        
+        self.report_prefix_cache()
         
         # Generate comprehensive review report
         self.generate_review_report(review_results)
@@ -2652,12 +4174,9 @@ class AIAssistant:
                     {"role": "user", "content": prompt}
                 ]
                 
-                response = self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro")
-                if response:
-                    explanation = response["choices"][0]["message"]["content"]
-                    print(f"\n📘 Explanation:")
-                    print("=" * 30)
-                    print(explanation)
+                print(f"\n📘 Explanation:")
+                print("=" * 30)
+                self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro", stream=True)
                     
             elif command == 'debug':
                 issue = input("Describe the issue: ")
@@ -2668,12 +4187,9 @@ class AIAssistant:
                     {"role": "user", "content": prompt}
                 ]
                 
-                response = self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro")
-                if response:
-                    debug_info = response["choices"][0]["message"]["content"]
-                    print(f"\n🐛 Debug Information:")
-                    print("=" * 30)
-                    print(debug_info)
+                print(f"\n🐛 Debug Information:")
+                print("=" * 30)
+                self.cached_ai_call(messages, "meta-llama/llama-3-70b-instruct:nitro", stream=True)
                     
             elif command == 'test':
                 code_context = "\n".join([content for cmd, content in conversation_context if cmd == "code"][-1:])
@@ -2754,12 +4270,36 @@ class AIAssistant:
                 self.write_to_file(summary_filename, f"# Knowledge Base Summary\n\n{summary}")
                 print(f"✅ Summary saved to {summary_filename}")
 
+    def show_cache_stats(self):
+        """Show whether the response cache pays for itself, per tier and per feature"""
+        stats = self.cache_manager.get_stats()
+        print("\n📈 RESPONSE CACHE")
+        print("=" * 50)
+        print(f"Lookups: {stats['lookups']} | hit rate {stats['hit_rate']:.0%} | "
+              f"time saved {stats['time_saved']:.1f}s")
+        for tier, tier_stats in stats["tiers"].items():
+            print(f"  {tier:<7} {tier_stats['hits']} hits / {tier_stats['misses']} misses | "
+                  f"{tier_stats['evictions']} evictions | {tier_stats['bytes'] / 1024:.1f} KB served | "
+                  f"{tier_stats['time_saved']:.1f}s saved | {tier_stats['entries']} entries "
+                  f"({tier_stats['stored_bytes'] / 1024:.1f} KB)")
+        if stats["features"]:
+            print("\nPer feature:")
+            for feature, feature_stats in sorted(stats["features"].items(),
+                                                 key=lambda item: -item[1]["time_saved"]):
+                print(f"  {feature:<28} memory {feature_stats['memory_hits']} | disk {feature_stats['disk_hits']} | "
+                      f"miss {feature_stats['misses']} | saved {feature_stats['time_saved']:.1f}s")
+        if self.semantic_cache is not None:
+            semantic = self.semantic_cache.stats
+            print(f"\n♻️  Similar questions: {semantic['offered']} offered, {semantic['accepted']} accepted, "
+                  f"{semantic['refreshed']} refreshed ({len(self.semantic_cache.entries)} stored)")
+    
     def export_session(self):
         """Export conversation history and actions"""
         session_data = {
             "timestamp": datetime.now().isoformat(),
             "conversation": self.conversation_history,
-            "actions_taken": self.session_actions
+            "actions_taken": self.session_actions,
+            "cache_stats": self.cache_manager.get_stats()
         }
         
         filename = f"session_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -2793,18 +4333,32 @@ class AIAssistant:
         print("20. 🧠 Chain-of-Thought Reasoning - Advanced problem solving")
         print("21. 🔬 Enhanced Code Analysis - AI + Static analysis")
         print("22. ⚡ Parallel File Analysis - Fast multi-file processing")
-        print("23. 💾 Export Session    - Save your work session")
-        print("24. 🚪 Exit")
+        print("23. 📈 Cache Statistics  - Hit rates and time saved by the response cache")
+        print("24. 💾 Export Session    - Save your work session")
+        print("25. 🚪 Exit")
         print("="*80)
     
+    MENU_FEATURES = {
+        '1': "analyze_code", '2': "generate_code", '3': "modify_file", '4': "project_analysis",
+        '5': "batch_modify_files", '6': "code_quality_analysis", '7': "generate_project_structure",
+        '8': "compare_models_response", '9': "intelligent_debugging", '10': "performance_profiling",
+        '11': "comprehensive_testing", '12': "project_health_monitoring", '13': "migration_assistance",
+        '14': "code_smell_detector", '15': "dependency_graph_analyzer", '16': "code_complexity_analyzer",
+        '17': "code_review_assistant", '18': "pair_programming_mode", '19': "knowledge_base_builder",
+        '20': "chain_of_thought_reasoning", '21': "enhanced_code_analysis", '22': "parallel_file_analysis"
+    }
+    
     def run(self):
         """Main assistant loop"""
         print("🚀 Starting Enhanced AI Coding Assistant v5.0...")
         print(f"📚 Config loaded: {len(self.config)} settings")
+        if self.config["prefetch_enabled"]:
+            self.prefetcher.start()  # Warm project data while the menu waits for input
         
         while True:
             self.enhanced_menu()
-            choice = input("\nSelect option (1-24): ").strip()
+            choice = input("\nSelect option (1-25): ").strip()
+            self.current_feature = self.MENU_FEATURES.get(choice)
             
             if choice == '1':
                 self.analyze_code()
@@ -2851,8 +4405,15 @@ class AIAssistant:
             elif choice == '22':
                 self.parallel_file_analysis()
             elif choice == '23':
-                self.export_session()
+                self.show_cache_stats()
             elif choice == '24':
+                self.export_session()
+            elif choice == '25':
+                self.async_client.close()
+                if self.hedge_executor:
+                    self.hedge_executor.shutdown(wait=False)
+                self.backend.close()
+                self.cache_manager.close()
                 print("👋 Goodbye! Thanks for using AI Coding Assistant!")
                 break
             else:
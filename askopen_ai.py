@@ -7,6 +7,8 @@ import re
 from datetime import datetime
 from typing import List, Dict, Optional
 import difflib
+import threading
+from ai_backend import OllamaChatBackend, OLLAMA_URL
 
 # Required for Ollama integration
 try:
@@ -15,12 +17,136 @@ except ImportError:
     print("❌ Please install ollama: pip install ollama")
     exit(1)
 
+# Optional: real free-memory checks before loading a model
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+class ModelResidencyManager:
+    """Keep selected Ollama models warm and evict least-recently-used ones"""
+
+    def __init__(self, keep_alive: Dict, max_resident_gb: float = 16):
+        self.keep_alive = keep_alive
+        self.max_resident_bytes = int(max_resident_gb * 1024 ** 3)
+        self.resident = {}     # model -> RAM footprint in bytes (from ollama ps)
+        self.last_used = {}    # model -> time of last query or preload
+        self.model_sizes = {}  # model -> size on disk, used as footprint estimate
+        self.loading = set()
+        self.lock = threading.Lock()
+
+    def keep_alive_for(self, model: str) -> str:
+        """keep_alive value for a model (per-model override or default)"""
+        return self.keep_alive.get(model, self.keep_alive.get("default", "30m"))
+
+    def refresh(self):
+        """Sync the resident set with the models Ollama currently has loaded"""
+        try:
+            running = ollama.ps().get("models", [])
+        except Exception as e:
+            print(f"⚠️  Could not query loaded models: {e}")
+            return
+        with self.lock:
+            self.resident = {
+                (m.get("model") or m.get("name")): m.get("size", 0) for m in running
+            }
+
+    def estimate_size(self, model: str) -> int:
+        """Approximate RAM footprint of a model before it is loaded"""
+        if model not in self.model_sizes:
+            try:
+                for m in ollama.list().get("models", []):
+                    self.model_sizes[m.get("model") or m.get("name")] = m.get("size", 0)
+            except Exception:
+                pass
+        return self.model_sizes.get(model, 0)
+
+    def touch(self, model: str):
+        """Mark a model as just used"""
+        with self.lock:
+            self.last_used[model] = time.time()
+            self.resident.setdefault(model, self.model_sizes.get(model, 0))
+
+    def memory_is_tight(self, needed: int) -> bool:
+        """Whether loading another model of this size would exceed the budget"""
+        with self.lock:
+            resident_total = sum(self.resident.values())
+        if resident_total + needed > self.max_resident_bytes:
+            return True
+        return psutil is not None and psutil.virtual_memory().available < needed
+
+    def evict(self, model: str):
+        """Unload a model immediately (keep_alive=0)"""
+        try:
+            ollama.generate(model=model, prompt="", keep_alive=0)
+            print(f"♻️  Unloaded {model} to free memory")
+        except Exception as e:
+            print(f"⚠️  Could not unload {model}: {e}")
+        with self.lock:
+            self.resident.pop(model, None)
+
+    def make_room(self, model: str):
+        """Evict least-recently-used models until the new one fits"""
+        self.refresh()
+        if model in self.resident:
+            return
+        needed = self.estimate_size(model)
+        with self.lock:
+            candidates = sorted(
+                (m for m in self.resident if m != model and m not in self.loading),
+                key=lambda m: self.last_used.get(m, 0)
+            )
+        for candidate in candidates:
+            if not self.memory_is_tight(needed):
+                break
+            self.evict(candidate)
+
+    def ensure_room(self, model: str):
+        """Cheap pre-query check: only reconcile when the model is not known to be loaded"""
+        if model not in self.resident:
+            self.make_room(model)
+
+    def preload(self, model: str):
+        """Load a model into memory with its keep_alive so the first query is warm"""
+        try:
+            self.make_room(model)
+            ollama.generate(model=model, prompt="", keep_alive=self.keep_alive_for(model))
+            self.touch(model)
+            self.refresh()
+        except Exception as e:
+            print(f"\n⚠️  Preloading {model} failed: {e}")
+        finally:
+            with self.lock:
+                self.loading.discard(model)
+
+    def preload_async(self, model: str):
+        """Warm a model in the background unless it is already resident or loading"""
+        with self.lock:
+            if model in self.resident or model in self.loading:
+                return
+            self.loading.add(model)
+        threading.Thread(target=self.preload, args=(model,), daemon=True).start()
+
+    def status(self, model: str) -> str:
+        """Short residency label for menus"""
+        if model in self.loading:
+            return "⏳ loading"
+        if model in self.resident:
+            return f"🔥 resident ({self.resident[model] / 1024 ** 3:.1f} GB)"
+        return ""
+
 class AIAssistant:
     def __init__(self):
         self.conversation_history = []
         self.config = self.load_config()
         self.session_actions = []  # Track all actions taken
         self.current_model = "mistral:7b"  # Default model
+        self.last_call_timings = {}  # Durations reported by the last Ollama call
+        self.backend = OllamaChatBackend(self.config["ollama_url"])
+        self.residency = ModelResidencyManager(
+            self.config["model_keep_alive"],
+            self.config["max_resident_memory_gb"]
+        )
         # All your installed models
         self.available_models = [
             "mistral:7b",
@@ -37,9 +163,10 @@ class AIAssistant:
         print("\n🧠 Available Local Models:")
         print("=" * 40)
         
+        self.residency.refresh()
         for i, model in enumerate(self.available_models, 1):
             marker = "⭐" if model == self.current_model else "  "
-            print(f"{marker} {i}. {model}")
+            print(f"{marker} {i}. {model} {self.residency.status(model)}")
         
         print(f"\nCurrent model: {self.current_model}")
         choice = input("\nSelect model (1-{}) or press Enter to keep current: ".format(len(self.available_models)))
@@ -49,6 +176,7 @@ class AIAssistant:
             if 1 <= choice_num <= len(self.available_models):
                 self.current_model = self.available_models[choice_num - 1]
                 print(f"✅ Model changed to: {self.current_model}")
+                self.residency.preload_async(self.current_model)
             else:
                 print("❌ Invalid selection. Keeping current model.")
         elif choice.strip() == "":
@@ -66,7 +194,10 @@ class AIAssistant:
                 "src/components/BaseAdmin", "src/components/BaseUser", 
                 "src/components/BaseWorker", "src/components/common"
             ],
-            "preferred_extensions": [".jsx", ".js", ".ts", ".tsx", ".css", ".json"]
+            "preferred_extensions": [".jsx", ".js", ".ts", ".tsx", ".css", ".json"],
+            "model_keep_alive": {"default": "30m"},
+            "max_resident_memory_gb": 16,
+            "ollama_url": OLLAMA_URL
         }
         
         try:
@@ -226,31 +357,56 @@ class AIAssistant:
         
         return response_text.strip()
 
-    def robust_ai_call(self, messages: List[Dict], model: str = None, max_retries: int = 3) -> Optional[Dict]:
-        """Use Ollama for local AI inference"""
+    def robust_ai_call(self, messages: List[Dict], model: str = None, max_retries: int = 3,
+                       echo: bool = False) -> Optional[Dict]:
+        """Use Ollama for local AI inference (streamed; Ctrl-C cancels generation)"""
         # Use provided model or current selected model
         ollama_model = model if model else self.current_model
+        print(f"🤖 Querying local Ollama model: {ollama_model}...")
+
+        self.residency.ensure_room(ollama_model)
+        self.residency.touch(ollama_model)
+        metrics = {}
+        parts = []
+        stream = self.backend.stream_chat(
+            messages, ollama_model, max_retries, metrics=metrics,
+            keep_alive=self.residency.keep_alive_for(ollama_model)
+        )
+        try:
+            for token in stream:
+                parts.append(token)
+                if echo:
+                    print(token, end="", flush=True)
+                else:
+                    print(f"\r✍️  Generating... {len(parts)} tokens", end="", flush=True)
+            print()
+        except KeyboardInterrupt:
+            # Stop generating but keep the assistant session alive
+            stream.close()
+            print(f"\n⛔ Generation cancelled after {len(parts)} tokens.")
+            return None
+        except Exception as e:
+            print(f"\n❌ Ollama error: {e}")
+            return None
+
+        if not metrics:
+            return None
+        timings = self.report_ollama_timings(metrics.get("provider", {}))
+        return {
+            "choices": [{"message": {"content": "".join(parts)}}],
+            "timings": timings
+        }
 
-        for attempt in range(max_retries):
-            try:
-                print(f"🤖 Querying local Ollama model: {ollama_model}...")
-
-                response = ollama.chat(
-                    model=ollama_model,
-                    messages=[{"role": msg["role"], "content": msg["content"]} for msg in messages],
-                )
-
-                return {
-                    "choices": [{"message": {"content": response["message"]["content"]}}]
-                }
+    def report_ollama_timings(self, timings: Dict) -> Dict:
+        """Print prompt-eval and eval durations reported in Ollama's final stream chunk"""
+        if not timings:
+            return {}
+        self.last_call_timings = timings
 
-            except Exception as e:
-                print(f"❌ Ollama error (attempt {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                else:
-                    return None
-        return None
+        print(f"⏱️  load {timings['load_duration']:.2f}s | "
+              f"prompt eval {timings['prompt_eval_count']} tok in {timings['prompt_eval_duration']:.2f}s | "
+              f"eval {timings['eval_count']} tok in {timings['eval_duration']:.2f}s ({timings['eval_rate']:.1f} tok/s)")
+        return timings
 
     def read_project_files_smart(self) -> str:
         """Read essential project files"""
@@ -348,13 +504,12 @@ class AIAssistant:
         
         self.add_to_history("user", f"Analysis request: {question}")
         
-        response = self.robust_ai_call(messages)
+        print("\n💡 Analysis Result:")
+        print("=" * 50)
+        response = self.robust_ai_call(messages, echo=True)
         
         if response and response.get("choices"):
             answer = response["choices"][0]["message"]["content"]
-            print("\n💡 Analysis Result:")
-            print("=" * 50)
-            print(answer)
             self.add_to_history("assistant", answer)
             
             save = input("\n💾 Save analysis to file? (y/n): ")
@@ -466,13 +621,12 @@ class AIAssistant:
             {"role": "user", "content": f"Analyze this React project:\n{context}\n\nProvide: 1) Project overview 2) Key features 3) Architecture 4) Recommendations"}
         ]
         
-        response = self.robust_ai_call(messages)
+        print("\n📋 Project Analysis:")
+        print("=" * 50)
+        response = self.robust_ai_call(messages, echo=True)
         
         if response and response.get("choices"):
             analysis = response["choices"][0]["message"]["content"]
-            print("\n📋 Project Analysis:")
-            print("=" * 50)
-            print(analysis)
             
             save = input("\n💾 Save analysis? (y/n): ")
             if save.lower() == 'y':
@@ -543,12 +697,11 @@ class AIAssistant:
             {"role": "user", "content": f"Code to review:\n{content}\n\nProvide specific suggestions with line numbers."}
         ]
         
-        response = self.robust_ai_call(messages)
+        print("\n🔍 Code Quality Analysis:")
+        print("=" * 50)
+        response = self.robust_ai_call(messages, echo=True)
         if response:
             analysis = response["choices"][0]["message"]["content"]
-            print("\n🔍 Code Quality Analysis:")
-            print("=" * 50)
-            print(analysis)
             
             save = input("\n💾 Save analysis? (y/n): ")
             if save.lower() == 'y':
@@ -693,6 +846,7 @@ class AIAssistant:
         """Main assistant loop"""
         print("🚀 Starting Enhanced AI Coding Assistant v3.0...")
         print(f"📚 Available models: {len(self.available_models)}")
+        self.residency.preload_async(self.current_model)
         
         while True:
             self.enhanced_menu()
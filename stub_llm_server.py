@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+🧪 Stub LLM Server
+Deterministic local stand-in for OpenRouter chat completions (JSON + SSE) and
+Ollama /api/chat and /api/generate (JSON + NDJSON), for load and latency testing
+
+Usage:
+    python stub_llm_server.py --port 8765 --latency lognormal:0.4:0.5 --tokens-per-sec 40 --error-rate 0.02
+
+Point the assistants at it:
+    OPENROUTER_URL=http://127.0.0.1:8765/api/v1/chat/completions OLLAMA_HOST=http://127.0.0.1:8765 python askasistance_ai_8.py
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from typing import List, Dict, Optional, Tuple
+
+DEFAULT_CONFIG = {
+    "latency": "fixed:0.2",          # time to first token: fixed:S | uniform:LO:HI | normal:MEAN:SD | lognormal:MEDIAN:SIGMA
+    "tokens_per_sec": 50.0,          # generation speed once the first token is out
+    "error_rate": 0.0,               # share of requests answered with HTTP 500
+    "rate_limit_rate": 0.0,          # share of requests answered with HTTP 429
+    "retry_after": 1,                # Retry-After seconds sent with injected 429s
+    "response_mode": "echo",         # echo | canned | lorem
+    "canned_responses": {},          # substring of the last user message -> reply
+    "default_response": "This is a stub response from the local test server.",
+    "max_tokens": 256,               # cap on generated tokens per reply
+    "seed": 42,
+    "models": ["stub-model", "deepseek-coder:6.7b", "codellama:7b"]
+}
+
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut "
+         "aliquip ex ea commodo consequat. ")
+
+class StubBehaviour:
+    """Seeded latency, failure injection and reply text for every request"""
+    
+    def __init__(self, config: Dict):
+        self.config = config
+        self.lock = Lock()
+        self.seen = {}  # request fingerprint -> times seen, so retries draw new outcomes
+        self.stats = {"requests": 0, "errors_injected": 0, "rate_limited": 0, "tokens_sent": 0, "cached_tokens": 0}
+        self.prefixes = set()  # hashes of prompt prefixes seen so far, for simulated prefix caching
+    
+    def rng_for(self, body: bytes) -> random.Random:
+        """RNG derived from seed, request body and attempt number (independent of interleaving)"""
+        digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+        with self.lock:
+            attempt = self.seen.get(digest, 0)
+            self.seen[digest] = attempt + 1
+            self.stats["requests"] += 1
+        return random.Random(f"{self.config['seed']}:{digest}:{attempt}")
+    
+    def first_token_delay(self, rng: random.Random) -> float:
+        """Sample the configured latency distribution"""
+        kind, *params = str(self.config["latency"]).split(":")
+        values = [float(p) for p in params]
+        if kind == "uniform":
+            return rng.uniform(values[0], values[1])
+        if kind == "normal":
+            return max(0.0, rng.gauss(values[0], values[1]))
+        if kind == "lognormal":
+            return rng.lognormvariate(math.log(values[0]), values[1])
+        return values[0] if values else 0.0
+    
+    def failure(self, rng: random.Random) -> Optional[int]:
+        """Injected HTTP status for this request, or None to answer normally"""
+        roll = rng.random()
+        if roll < self.config["rate_limit_rate"]:
+            with self.lock:
+                self.stats["rate_limited"] += 1
+            return 429
+        if roll < self.config["rate_limit_rate"] + self.config["error_rate"]:
+            with self.lock:
+                self.stats["errors_injected"] += 1
+            return 500
+        return None
+    
+    def reply_text(self, prompt: str) -> str:
+        mode = self.config["response_mode"]
+        if mode == "canned":
+            for needle, reply in self.config["canned_responses"].items():
+                if needle in prompt:
+                    return reply
+            return self.config["default_response"]
+        if mode == "lorem":
+            return LOREM * 8
+        return f"Echo: {prompt}" if prompt else self.config["default_response"]
+    
+    def tokens(self, text: str) -> List[str]:
+        """Split text into word-sized tokens, capped at max_tokens"""
+        tokens = []
+        word = ""
+        for ch in text:
+            word += ch
+            if ch in " \n":
+                tokens.append(word)
+                word = ""
+        if word:
+            tokens.append(word)
+        return tokens[:self.config["max_tokens"]]
+    
+    def token_interval(self) -> float:
+        rate = self.config["tokens_per_sec"]
+        return 1.0 / rate if rate > 0 else 0.0
+    
+    def cached_prefix_tokens(self, prompt: str) -> int:
+        """Simulate provider prefix caching: tokens in the longest 256-char-aligned prefix seen before"""
+        block = 256
+        hashes = [hashlib.blake2b(prompt[:end].encode("utf-8"), digest_size=8).digest()
+                  for end in range(block, len(prompt) + 1, block)]
+        with self.lock:
+            cached_chars = 0
+            for index, digest in enumerate(hashes):
+                if digest not in self.prefixes:
+                    break
+                cached_chars = (index + 1) * block
+            self.prefixes.update(hashes)
+        cached = len(prompt[:cached_chars].split())
+        with self.lock:
+            self.stats["cached_tokens"] += cached
+        return cached
+    
+    def count_tokens(self, count: int):
+        with self.lock:
+            self.stats["tokens_sent"] += count
+
+def message_text(msg: Dict) -> str:
+    """Message content as text (OpenAI-style content parts are joined)"""
+    content = msg.get("content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+def last_user_message(messages: List[Dict]) -> str:
+    user_messages = [message_text(msg) for msg in messages if msg.get("role") == "user"]
+    return user_messages[-1] if user_messages else ""
+
+def fake_context(prompt: str, reply: str) -> List[int]:
+    """Stand-in for Ollama's /api/generate context: one int per prompt and reply token"""
+    words = (prompt + " " + reply).split()
+    return [int(hashlib.blake2b(w.encode("utf-8"), digest_size=2).hexdigest(), 16) for w in words]
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Routes OpenRouter- and Ollama-style requests to the stub behaviour"""
+    
+    protocol_version = "HTTP/1.1"
+    behaviour = None  # set by make_server()
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    # ---------- plumbing ----------
+    
+    def send_json(self, status: int, data: Dict, headers: Optional[Dict] = None):
+        body = json.dumps(data).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, str(value))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client gave up waiting (e.g. its deadline clamped the timeout)
+    
+    def start_stream(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+    
+    def write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+    
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+    
+    def read_request(self) -> Tuple[bytes, Dict]:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b"{}"
+        try:
+            return body, json.loads(body or b"{}")
+        except ValueError:
+            return body, {}
+    
+    @staticmethod
+    def error_body(message: str, code: int, openrouter: bool) -> Dict:
+        """OpenRouter nests errors in an object, Ollama sends a plain string"""
+        return {"error": {"message": message, "code": code}} if openrouter else {"error": message}
+    
+    def inject_failure(self, rng: random.Random, openrouter: bool) -> bool:
+        """Answer with an injected 429/500 when the dice say so"""
+        status = self.behaviour.failure(rng)
+        if status == 429:
+            retry_after = self.behaviour.config["retry_after"]
+            headers = {"Retry-After": retry_after}
+            if openrouter:
+                headers["X-RateLimit-Remaining"] = 0
+                headers["X-RateLimit-Reset"] = int((time.time() + retry_after) * 1000)
+            self.send_json(429, self.error_body("Rate limit exceeded (stub)", 429, openrouter), headers)
+            return True
+        if status == 500:
+            self.send_json(500, self.error_body("Injected server error (stub)", 500, openrouter))
+            return True
+        return False
+    
+    # ---------- routes ----------
+    
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json(200, {"models": [
+                {"name": name, "model": name, "size": 4 * 1024 ** 3} for name in self.behaviour.config["models"]
+            ]})
+        elif self.path == "/api/ps":
+            self.send_json(200, {"models": []})
+        elif self.path == "/stats":
+            self.send_json(200, self.behaviour.stats)
+        else:
+            self.send_json(404, {"error": "not found"})
+    
+    def do_POST(self):
+        body, request = self.read_request()
+        rng = self.behaviour.rng_for(body)
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self.openrouter_chat(request, rng)
+        elif self.path == "/api/chat":
+            self.ollama(request, rng, generate=False)
+        elif self.path == "/api/generate":
+            self.ollama(request, rng, generate=True)
+        else:
+            self.send_json(404, {"error": "not found"})
+    
+    def openrouter_chat(self, request: Dict, rng: random.Random):
+        """OpenAI/OpenRouter chat completions, plain JSON or SSE"""
+        if self.inject_failure(rng, openrouter=True):
+            return
+        model = request.get("model", "stub-model")
+        messages = request.get("messages", [])
+        prompt_text = "\n".join(f"{msg.get('role')}: {message_text(msg)}" for msg in messages)
+        prompt_tokens = len(prompt_text.split())
+        tokens = self.behaviour.tokens(self.behaviour.reply_text(last_user_message(messages)))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens),
+                 "prompt_tokens_details": {"cached_tokens": self.behaviour.cached_prefix_tokens(prompt_text)}}
+        completion_id = f"gen-stub-{rng.randrange(16 ** 12):012x}"
+        delay = self.behaviour.first_token_delay(rng)
+        interval = self.behaviour.token_interval()
+        
+        if not request.get("stream"):
+            time.sleep(delay + interval * len(tokens))
+            self.behaviour.count_tokens(len(tokens))
+            self.send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage
+            }, {"X-RateLimit-Remaining": 1000, "X-RateLimit-Reset": int((time.time() + 60) * 1000)})
+            return
+        
+        self.start_stream("text/event-stream")
+        try:
+            # OpenRouter sends comment keep-alives while the model warms up
+            self.write_chunk(": OPENROUTER PROCESSING\n\n")
+            time.sleep(delay)
+            for token in tokens:
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                time.sleep(interval)
+            final = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            self.write_chunk(f"data: {json.dumps(final)}\n\n")
+            self.write_chunk("data: [DONE]\n\n")
+            self.end_stream()
+            self.behaviour.count_tokens(len(tokens))
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client cancelled the stream
+    
+    def ollama(self, request: Dict, rng: random.Random, generate: bool):
+        """Ollama /api/chat or /api/generate, single JSON object or NDJSON stream"""
+        if self.inject_failure(rng, openrouter=False):
+            return
+        model = request.get("model", "stub-model")
+        if generate:
+            prompt = request.get("prompt", "")
+            # Like Ollama with a warm KV cache, tokens carried in via context are not re-evaluated
+            prompt_tokens = len((request.get("system", "") + " " + prompt).split())
+        else:
+            prompt = last_user_message(request.get("messages", []))
+            prompt_tokens = sum(len(message_text(msg).split()) for msg in request.get("messages", []))
+        reply = self.behaviour.reply_text(prompt)
+        tokens = self.behaviour.tokens(reply)
+        delay = self.behaviour.first_token_delay(rng)
+        interval = self.behaviour.token_interval()
+        start = time.perf_counter()
+        
+        def piece(text: str, done: bool) -> Dict:
+            data = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+            if generate:
+                data["response"] = text
+            else:
+                data["message"] = {"role": "assistant", "content": text}
+            return data
+        
+        def final_fields(data: Dict) -> Dict:
+            eval_duration = int(interval * len(tokens) * 1e9)
+            data.update({
+                "done_reason": "stop",
+                "total_duration": int((time.perf_counter() - start) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(delay * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": eval_duration
+            })
+            if generate:
+                data["context"] = (request.get("context") or []) + fake_context(prompt, reply)
+            return data
+        
+        if not request.get("stream", True):
+            time.sleep(delay + interval * len(tokens))
+            self.behaviour.count_tokens(len(tokens))
+            self.send_json(200, final_fields(piece("".join(tokens), True)))
+            return
+        
+        self.start_stream("application/x-ndjson")
+        try:
+            time.sleep(delay)
+            for token in tokens:
+                self.write_chunk(json.dumps(piece(token, False)) + "\n")
+                time.sleep(interval)
+            self.write_chunk(json.dumps(final_fields(piece("", True))) + "\n")
+            self.end_stream()
+            self.behaviour.count_tokens(len(tokens))
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client cancelled the stream
+
+def load_config(path: Optional[str] = None, overrides: Optional[Dict] = None) -> Dict:
+    """Defaults, then an optional JSON config file, then command-line overrides"""
+    config = dict(DEFAULT_CONFIG)
+    if path:
+        try:
+            with open(path, 'r') as f:
+                config.update(json.load(f))
+        except Exception as e:
+            print(f"Config load error: {e}")
+    config.update({key: value for key, value in (overrides or {}).items() if value is not None})
+    return config
+
+def make_server(host: str = "127.0.0.1", port: int = 8765, config: Optional[Dict] = None,
+                verbose: bool = False) -> ThreadingHTTPServer:
+    """Build (but don't start) a stub server; port 0 picks a free port"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"behaviour": StubBehaviour(config or load_config())})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic stub for OpenRouter and Ollama APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--config", help="JSON file with any of the DEFAULT_CONFIG keys")
+    parser.add_argument("--latency", help="fixed:S | uniform:LO:HI | normal:MEAN:SD | lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--tokens-per-sec", type=float, dest="tokens_per_sec")
+    parser.add_argument("--error-rate", type=float, dest="error_rate")
+    parser.add_argument("--rate-limit-rate", type=float, dest="rate_limit_rate")
+    parser.add_argument("--retry-after", type=int, dest="retry_after")
+    parser.add_argument("--response-mode", choices=["echo", "canned", "lorem"], dest="response_mode")
+    parser.add_argument("--max-tokens", type=int, dest="max_tokens")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--verbose", action="store_true")
+    args = vars(parser.parse_args())
+    
+    host, port, verbose = args.pop("host"), args.pop("port"), args.pop("verbose")
+    config = load_config(args.pop("config"), args)
+    server = make_server(host, port, config, verbose)
+    print(f"🧪 Stub LLM server on http://{host}:{server.server_address[1]}")
+    print(f"   OpenRouter: http://{host}:{server.server_address[1]}/api/v1/chat/completions")
+    print(f"   Ollama:     http://{host}:{server.server_address[1]}  (/api/chat, /api/generate)")
+    print(f"   Latency {config['latency']} | {config['tokens_per_sec']} tok/s | "
+          f"errors {config['error_rate']:.0%} | 429s {config['rate_limit_rate']:.0%} | mode {config['response_mode']}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stub server stopped")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()